@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+
+"""contention.py
+
+Registration, wishlist and profile contention simulator. Drives
+ConferenceApi's registerForConference, unregisterFromConference,
+addSessionToWishlist and saveProfile from many threads against the local
+testbed stubs, then checks the datastore for lost updates. Results are
+one JSON object per run, appended to --out so they can be compared from
+release to release. Requires the App Engine Python SDK.
+
+usage: python benchmarks/contention.py --sdk ~/google_appengine
+       [--threads 16] [--ops 200] [--users 50] [--seats 30]
+       [--sessions 20] [--admission-queue] [--out results.jsonl]
+
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import date
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# operation -> relative weight in the mix
+MIX = (('register', 4), ('unregister', 1), ('wishlist', 4), ('profile', 2))
+
+
+def setupPaths(sdk):
+    sys.path.insert(0, sdk)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    sys.path.insert(0, ROOT)
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100.0))]
+
+
+class Stats(object):
+    """Thread-safe counters and latencies per operation."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.outcomes = defaultdict(lambda: defaultdict(int))
+        self.transactions = 0
+        self.retries = 0
+        # (user, session) pairs reported as added to a wishlist
+        self.wishlisted = set()
+
+    def record(self, op, outcome, seconds):
+        with self.lock:
+            self.latencies[op].append(seconds * 1000.0)
+            self.outcomes[op][outcome] += 1
+
+    def recordTransaction(self, attempts):
+        with self.lock:
+            self.transactions += 1
+            self.retries += max(attempts - 1, 0)
+
+
+def countTransactionAttempts(stats):
+    """Wrap ndb's Context.transaction so every transaction reports how
+    many times its callback ran (attempts - 1 == retries)."""
+    from google.appengine.ext.ndb import context
+
+    original = context.Context.transaction
+
+    def transaction(self, callback, **ctx_options):
+        attempts = [0]
+
+        def counted():
+            attempts[0] += 1
+            return callback()
+
+        fut = original(self, counted, **ctx_options)
+        fut.add_callback(lambda: stats.recordTransaction(attempts[0]))
+        return fut
+
+    context.Context.transaction = transaction
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--sdk', default=os.environ.get('APPENGINE_SDK'))
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--ops', type=int, default=200,
+                        help='operations per thread')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--seats', type=int, default=30)
+    parser.add_argument('--sessions', type=int, default=20)
+    parser.add_argument('--admission-queue', action='store_true',
+                        help='register through the admission queue')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='append the JSON result to this file')
+    args = parser.parse_args()
+    if not args.sdk:
+        parser.error('--sdk or APPENGINE_SDK is required')
+    setupPaths(args.sdk)
+
+    import endpoints
+    from google.appengine.api import users
+    from google.appengine.datastore import datastore_stub_util
+    from google.appengine.ext import ndb
+    from google.appengine.ext import testbed
+
+    bed = testbed.Testbed()
+    bed.activate()
+    bed.setup_env(auth_domain='example.com', overwrite=True)
+    bed.init_datastore_v3_stub(
+        consistency_policy=datastore_stub_util.
+        PseudoRandomHRConsistencyPolicy(probability=1))
+    bed.init_memcache_stub()
+    bed.init_taskqueue_stub(root_path=ROOT)
+
+    import conference
+    import ratelimit
+    from models import Conference
+    from models import ConflictException
+    from models import Profile
+    from models import ProfileMiniForm
+    from models import Session
+
+    # the simulator measures contention, not the rate limiter
+    ratelimit.RATE_LIMIT_CAPACITY = ratelimit.RATE_LIMIT_USER_CAPACITY = \
+        sys.maxint
+
+    local = threading.local()
+    endpoints.get_current_user = lambda: getattr(local, 'user', None)
+
+    # one conference with its sessions, organized by user 0
+    organizer = ndb.Key(Profile, 'user0@example.com')
+    c_key = ndb.Key(Conference,
+                    Conference.allocate_ids(size=1, parent=organizer)[0],
+                    parent=organizer)
+    Conference(key=c_key, name='Simulated', organizerUserId=organizer.id(),
+               maxAttendees=args.seats, seatsAvailable=args.seats,
+               admissionQueue=args.admission_queue).put()
+    wsck = c_key.urlsafe()
+    # sessions hang off the same pseudo parent conference.py uses
+    s_parent = ndb.Key(Conference, wsck)
+    session_keys = ndb.put_multi([
+        Session(parent=s_parent, name='Session %d' % i, speaker='Speaker',
+                duration=60, typeOfSession='talk', date=date(2026, 3, 10),
+                startTime=datetime(2026, 3, 10, 8 + i % 10).time(),
+                websafeConferenceKey=wsck)
+        for i in range(args.sessions)])
+    wssks = [k.urlsafe() for k in session_keys]
+
+    stats = Stats()
+    countTransactionAttempts(stats)
+    api = conference.ConferenceApi()
+    conf_request = conference.CONF_GET_REQUEST.combined_message_class(
+        websafeConferenceKey=wsck)
+    ops = [op for op, weight in MIX for _ in range(weight)]
+
+    def worker(seed):
+        rng = random.Random(seed)
+        ctx = ndb.get_context()
+        ctx.set_cache_policy(False)
+        for _ in range(args.ops):
+            email = 'user%d@example.com' % rng.randrange(args.users)
+            local.user = users.User(email=email)
+            op = rng.choice(ops)
+            start = time.time()
+            try:
+                if op == 'register':
+                    outcome = api.registerForConference(conf_request).data
+                elif op == 'unregister':
+                    outcome = api.unregisterFromConference(conf_request).data
+                elif op == 'wishlist':
+                    wssk = rng.choice(wssks)
+                    msg = api.addSessionToWishlist(
+                        conference.WISHLIST_POST_REQUEST.
+                        combined_message_class(sessionKey=wssk)).data
+                    outcome = msg.startswith('Session added')
+                    if outcome:
+                        with stats.lock:
+                            stats.wishlisted.add((email, wssk))
+                else:
+                    api.saveProfile(ProfileMiniForm(
+                        displayName='name %d' % rng.randrange(1000)))
+                    outcome = True
+                outcome = 'ok' if outcome else 'noop'
+            except ConflictException:
+                outcome = 'conflict'
+            except Exception as e:
+                outcome = 'error:%s' % type(e).__name__
+            stats.record(op, outcome, time.time() - start)
+
+    threads = [threading.Thread(target=worker, args=(args.seed + i,))
+               for i in range(args.threads)]
+    started = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - started
+
+    if args.admission_queue:
+        while conference.ConferenceApi._settleRegistrations(wsck):
+            pass
+
+    # consistency checks against what the datastore ended up holding
+    ndb.get_context().clear_cache()
+    conf = c_key.get()
+    profiles = Profile.query().fetch()
+    registered = sum(1 for p in profiles
+                     if c_key in p.conferenceKeysToAttend)
+    seats_sold = conf.maxAttendees - conf.seatsAvailable
+    stored = set((p.key.id(), k.urlsafe()) for p in profiles
+                 for k in p.sessionWishlist)
+    violations = {
+        'seats_sold_vs_registered': seats_sold - registered,
+        'oversold': max(registered - conf.maxAttendees, 0),
+        'negative_seats': int(conf.seatsAvailable < 0),
+        'lost_wishlist_adds': len(stats.wishlisted - stored),
+    }
+
+    try:
+        revision = subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+
+    total_ops = sum(len(v) for v in stats.latencies.values())
+    result = {
+        'revision': revision,
+        'timestamp': datetime.utcnow().isoformat(),
+        'config': dict((k, v) for k, v in vars(args).items()
+                       if k not in ('sdk', 'out')),
+        'elapsed_s': elapsed,
+        'throughput_ops_s': total_ops / elapsed if elapsed else None,
+        'operations': dict(
+            (op, {'count': len(lat),
+                  'p50_ms': percentile(lat, 50),
+                  'p99_ms': percentile(lat, 99),
+                  'outcomes': dict(stats.outcomes[op])})
+            for op, lat in stats.latencies.items()),
+        'transactions': stats.transactions,
+        'transaction_retries': stats.retries,
+        'violations': violations,
+    }
+    bed.deactivate()
+
+    line = json.dumps(result, sort_keys=True)
+    if args.out:
+        with open(args.out, 'a') as out:
+            out.write(line + '\n')
+    print(json.dumps(result, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+
+"""migration_run.py
+
+Migration framework check. Runs the conference_week_buckets migration
+over a generated catalog on the local testbed stubs, executing its task
+chain by hand while other threads keep changing seatsAvailable, and
+pauses and resumes the run in the middle of a batch. Reports the tasks
+run and dropped as stale, and whether any conference was left
+unmigrated or any concurrent write lost. Requires the App Engine Python
+SDK.
+
+usage: python benchmarks/migration_run.py --sdk ~/google_appengine
+       [--conferences 500] [--threads 4] [--qps 50] [--resume-at 120]
+       [--json]
+
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urlparse
+from collections import defaultdict
+from datetime import date
+from datetime import timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MIGRATION = 'conference_week_buckets'
+
+
+def setupPaths(sdk):
+    sys.path.insert(0, sdk)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    sys.path.insert(0, ROOT)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--sdk', default=os.environ.get('APPENGINE_SDK'))
+    parser.add_argument('--conferences', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=4,
+                        help='threads writing seatsAvailable meanwhile')
+    parser.add_argument('--qps', type=int, default=50,
+                        help='migration QPS, which is also the batch size')
+    parser.add_argument('--resume-at', type=int, default=120,
+                        help='pause and resume when the migration reaches '
+                             'this conference')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true',
+                        help='print results as JSON')
+    args = parser.parse_args()
+    if not args.sdk:
+        parser.error('--sdk or APPENGINE_SDK is required')
+    setupPaths(args.sdk)
+
+    from google.appengine.datastore import datastore_stub_util
+    from google.appengine.ext import ndb
+    from google.appengine.ext import testbed
+
+    bed = testbed.Testbed()
+    bed.activate()
+    bed.init_datastore_v3_stub(
+        consistency_policy=datastore_stub_util.
+        PseudoRandomHRConsistencyPolicy(probability=1))
+    bed.init_memcache_stub()
+    bed.init_taskqueue_stub(root_path=ROOT)
+    queue = bed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+
+    import migrations
+    from models import Conference
+    from models import Profile
+    from utils import weekBuckets
+
+    # conferences from before weekBuckets existed, a few per organizer so
+    # entity groups are shared as in production
+    rng = random.Random(args.seed)
+    c_keys = []
+    for i in range(args.conferences):
+        organizer = ndb.Key(Profile, 'user%d@example.com' % (i // 5))
+        start = date(2026, 1, 1) + timedelta(days=rng.randrange(365))
+        c_keys.append(Conference(
+            parent=organizer, name='Conference %05d' % i,
+            organizerUserId=organizer.id(), startDate=start,
+            endDate=start + timedelta(days=rng.randrange(4)),
+            maxAttendees=1000, seatsAvailable=1000).put())
+
+    # pause and resume from inside the batch that reaches --resume-at,
+    # as an admin would while that batch's task is running
+    model, fn = migrations._REGISTRY[MIGRATION]
+    seen = [0]
+
+    @ndb.non_transactional
+    def pauseAndResume():
+        migrations.pauseMigration(MIGRATION)
+        migrations.resumeMigration(MIGRATION)
+
+    def hooked(conf):
+        seen[0] += 1
+        if seen[0] == args.resume_at:
+            pauseAndResume()
+        return fn(conf)
+    migrations._REGISTRY[MIGRATION] = (model, hooked)
+
+    # concurrent seat changes, counted per conference
+    writes = defaultdict(int)
+    lock = threading.Lock()
+    done = threading.Event()
+
+    def writer(seed):
+        local_rng = random.Random(seed)
+        ndb.get_context().set_cache_policy(False)
+        while not done.is_set():
+            c_key = local_rng.choice(c_keys)
+
+            @ndb.transactional
+            def _take():
+                conf = c_key.get()
+                conf.seatsAvailable -= 1
+                conf.put()
+            try:
+                _take()
+            except Exception:
+                continue
+            with lock:
+                writes[c_key] += 1
+
+    threads = [threading.Thread(target=writer, args=(args.seed + i,))
+               for i in range(args.threads)]
+    for t in threads:
+        t.start()
+
+    started = time.time()
+    migrations.startMigration(MIGRATION, qps=args.qps)
+    executed = stale = 0
+    while True:
+        tasks = queue.get_filtered_tasks(url='/tasks/migrate')
+        if not tasks:
+            break
+        queue.FlushQueue('default')
+        for task in tasks:
+            params = urlparse.parse_qs(task.payload)
+            generation = int(params['generation'][0])
+            if generation != migrations.MigrationRun.get_by_id(
+                    MIGRATION).generation:
+                stale += 1
+            migrations.runBatch(params['name'][0], generation)
+            executed += 1
+    elapsed = time.time() - started
+    done.set()
+    for t in threads:
+        t.join()
+
+    ndb.get_context().clear_cache()
+    run = migrations.MigrationRun.get_by_id(MIGRATION)
+    confs = ndb.get_multi(c_keys)
+    result = {
+        'config': dict((k, v) for k, v in vars(args).items()
+                       if k != 'sdk'),
+        'elapsed_s': elapsed,
+        'state': run.state,
+        'generation': run.generation,
+        'tasks_run': executed,
+        'tasks_stale': stale,
+        'concurrent_writes': sum(writes.values()),
+        'violations': {
+            'unmigrated': sum(
+                1 for conf in confs
+                if conf.weekBuckets != weekBuckets(conf.startDate,
+                                                   conf.endDate)),
+            'lost_writes': sum(
+                1 for conf in confs
+                if conf.seatsAvailable != 1000 - writes[conf.key]),
+        },
+    }
+    bed.deactivate()
+
+    if args.json:
+        print(json.dumps(result, indent=2, sort_keys=True))
+        return
+    print('%s: %s after %d tasks (%d stale) in %.1fs, generation %d' % (
+        MIGRATION, result['state'], executed, stale, elapsed,
+        result['generation']))
+    print('%d concurrent seat writes' % result['concurrent_writes'])
+    for name, count in sorted(result['violations'].items()):
+        print('%-12s %d' % (name, count))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+"""profile_keys.py
+
+Profile reference storage benchmark: encoded entity size and decode time
+of a Profile whose conferenceKeysToAttend and sessionWishlist hold
+websafe key strings (the old StringProperty format) versus key
+references (WebsafeKeyProperty), plus the cost of turning the loaded
+values into keys for get_multi. Requires the App Engine Python SDK.
+
+usage: python benchmarks/profile_keys.py --sdk ~/google_appengine
+       [--conferences 20] [--sessions 50] [--runs 2000] [--json]
+
+"""
+
+import argparse
+import json
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setupPaths(sdk):
+    sys.path.insert(0, sdk)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    sys.path.insert(0, ROOT)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--sdk', default=os.environ.get('APPENGINE_SDK'))
+    parser.add_argument('--conferences', type=int, default=20,
+                        help='conferences the profile attends')
+    parser.add_argument('--sessions', type=int, default=50,
+                        help='sessions in the wishlist')
+    parser.add_argument('--runs', type=int, default=2000)
+    parser.add_argument('--json', action='store_true',
+                        help='print results as JSON')
+    args = parser.parse_args()
+    if not args.sdk:
+        parser.error('--sdk or APPENGINE_SDK is required')
+    setupPaths(args.sdk)
+
+    os.environ.setdefault('APPLICATION_ID', 'dev~conference-central')
+    from google.appengine.datastore import entity_pb
+    from google.appengine.ext import ndb
+    from models import Conference
+    from models import Profile
+    from models import Session
+
+    # keys shaped like the real ones: conferences under their organizer,
+    # sessions under the websafe-keyed pseudo conference
+    conf_keys = [ndb.Key(Profile, 'organizer%d@example.com' % i,
+                         Conference, 5629499534213120 + i)
+                 for i in range(args.conferences)]
+    sess_keys = [ndb.Key(Conference, conf_keys[i % len(conf_keys)].urlsafe(),
+                         Session, 5066549580791808 + i)
+                 for i in range(args.sessions)]
+
+    class LegacyProfile(ndb.Model):
+        """The Profile schema before the key reference change."""
+        displayName = ndb.StringProperty()
+        mainEmail = ndb.StringProperty()
+        teeShirtSize = ndb.StringProperty(default='NOT_SPECIFIED')
+        conferenceKeysToAttend = ndb.StringProperty(repeated=True)
+        sessionWishlist = ndb.StringProperty(repeated=True)
+
+        @classmethod
+        def _get_kind(cls):
+            return 'Profile'
+
+    # keep key lookups resolving 'Profile' to the real model
+    ndb.Model._kind_map['Profile'] = Profile
+
+    fields = dict(displayName='Attendee', mainEmail='user@example.com')
+    key = ndb.Key(Profile, 'user@example.com')
+    legacy = LegacyProfile(
+        key=key, conferenceKeysToAttend=[k.urlsafe() for k in conf_keys],
+        sessionWishlist=[k.urlsafe() for k in sess_keys], **fields)
+    current = Profile(key=key, conferenceKeysToAttend=conf_keys,
+                      sessionWishlist=sess_keys, **fields)
+
+    encoded = {'strings': legacy._to_pb().Encode(),
+               'keys': current._to_pb().Encode()}
+
+    def load(model, data):
+        def run():
+            prof = model._from_pb(entity_pb.EntityProto(data))
+            # what a read path needs before it can call get_multi
+            if model is LegacyProfile:
+                return ([ndb.Key(urlsafe=w)
+                         for w in prof.conferenceKeysToAttend],
+                        [ndb.Key(urlsafe=w) for w in prof.sessionWishlist])
+            return prof.conferenceKeysToAttend, prof.sessionWishlist
+        return run
+
+    cases = (('strings', LegacyProfile, encoded['strings']),
+             ('keys', Profile, encoded['keys']),
+             # un-migrated entity read through WebsafeKeyProperty
+             ('strings_as_keys', Profile, encoded['strings']))
+    results = {}
+    for name, model, data in cases:
+        run = load(model, data)
+        assert [k.urlsafe() for k in run()[1]] == \
+            [k.urlsafe() for k in sess_keys]
+        best = min(timeit.repeat(run, number=args.runs, repeat=3))
+        results[name] = {'entity_bytes': len(data),
+                         'decode_us': best / args.runs * 1e6}
+
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+        return
+    print('%d conferences, %d wishlist sessions' % (args.conferences,
+                                                    args.sessions))
+    print('%-16s %12s %12s' % ('format', 'bytes', 'decode us'))
+    for name, _, _ in cases:
+        print('%-16s %12d %12.1f' % (name, results[name]['entity_bytes'],
+                                     results[name]['decode_us']))
+
+
+if __name__ == '__main__':
+    main()
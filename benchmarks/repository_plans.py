@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+
+"""repository_plans.py
+
+Query plan and latency benchmark for the repository's access patterns on
+the SQLite backend, which carries the composite indexes of index.yaml.
+Loads a synthetic catalog and then runs each pattern ConferenceApi uses.
+For each it prints the EXPLAIN QUERY PLAN rows and the median time, and
+flags plans that scan a whole table or sort in a temporary B-tree (the
+SQLite counterparts of a datastore query that would need a new index).
+Runs without the App Engine SDK.
+
+usage: python benchmarks/repository_plans.py [--conferences 5000]
+       [--sessions 20] [--profiles 2000] [--runs 20] [--db FILE] [--json]
+
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time as _time
+from datetime import date
+from datetime import time
+from datetime import timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sqlite_repository import SqliteRepository  # noqa: E402
+
+CITIES = ('London', 'Chicago', 'Paris', 'Tokyo', 'San Francisco', 'Berlin',
+          'Sydney', 'Toronto')
+TOPICS = ('Medical Innovations', 'Programming Languages', 'Web Technologies',
+          'Movie Making', 'Health and Nutrition', 'Machine Learning',
+          'Security', 'Databases', 'Design', 'Robotics')
+SESSION_TYPES = ('talk', 'workshop', 'keynote', 'lecture')
+SPEAKERS = 200
+
+
+def weekBuckets(start, end):
+    # same encoding as utils.weekBuckets, which imports App Engine APIs
+    buckets = []
+    day = start - timedelta(days=start.weekday())
+    while day <= end:
+        year, week, _ = day.isocalendar()
+        buckets.append(year * 100 + week)
+        day += timedelta(days=7)
+    return buckets
+
+
+def load(repo, args, rng):
+    """Fill the repository with a synthetic catalog."""
+    confs = []
+    for i in range(args.conferences):
+        start = date(2026, 1, 1) + timedelta(days=rng.randrange(365))
+        end = start + timedelta(days=rng.randrange(4))
+        seats = rng.choice((10, 50, 100, 500, 1000))
+        confs.append(repo.addConference(
+            name='Conference %05d' % i, description='',
+            organizerUserId='user%d@example.com' % rng.randrange(
+                args.profiles),
+            topics=rng.sample(TOPICS, rng.randint(1, 3)),
+            city=rng.choice(CITIES), startDate=start, endDate=end,
+            month=start.month, maxAttendees=seats,
+            seatsAvailable=rng.randrange(seats + 1),
+            weekBuckets=weekBuckets(start, end)))
+
+    sessions = []
+    for conf in confs:
+        wsck = conf.key.urlsafe()
+        for j in range(args.sessions):
+            sessions.append(repo.createSession(wsck, dict(
+                name='Session %d' % j, highlights='',
+                speaker='Speaker %d' % rng.randrange(SPEAKERS),
+                duration=rng.choice((30, 45, 60, 90)),
+                typeOfSession=rng.choice(SESSION_TYPES),
+                date=conf.startDate,
+                startTime=time(8 + rng.randrange(10), rng.choice((0, 30))),
+                websafeConferenceKey=wsck)))
+
+    for i in range(args.profiles):
+        repo.createProfile(
+            'user%d@example.com' % i, displayName='User %d' % i,
+            mainEmail='user%d@example.com' % i,
+            teeShirtSize='NOT_SPECIFIED',
+            conferenceKeysToAttend=[c.key for c in rng.sample(confs, 5)],
+            sessionWishlist=[s.key for s in rng.sample(sessions, 10)])
+    repo.commit()
+    return confs, sessions
+
+
+def patterns(repo, confs, rng):
+    """(name, fn, args) for each access pattern ConferenceApi uses."""
+    conf = rng.choice(confs)
+    wsck = conf.key.urlsafe()
+    prof = repo.getProfile('user0@example.com')
+    eq = lambda field, value: {'field': field, 'operator': '=',
+                               'value': value}
+    gt = lambda field, value: {'field': field, 'operator': '>',
+                               'value': value}
+    return [
+        ('getConference', repo.getConference, (wsck,)),
+        ('getConferencesCreated', repo.conferencesByOrganizer,
+         (conf.organizerUserId,)),
+        ('queryConferences: none', repo.queryConferences, ([],)),
+        ('queryConferences: city', repo.queryConferences,
+         ([eq('city', 'London')],)),
+        ('queryConferences: city+topic', repo.queryConferences,
+         ([eq('city', 'London'), eq('topics', 'Security')],)),
+        ('queryConferences: topic+month+maxAttendees>',
+         repo.queryConferences,
+         ([eq('topics', 'Databases'), eq('month', 6),
+           gt('maxAttendees', 50)], 'maxAttendees')),
+        ('queryConferences: two topics', repo.queryConferences,
+         ([eq('topics', 'Security'), eq('topics', 'Databases')],)),
+        ('queryConferencesByDateRange: city', repo.queryConferences,
+         ([eq('city', 'Paris')], None, conf.weekBuckets)),
+        ('getConferencesToAttend', repo.conferencesToAttend, (prof,)),
+        ('getConferenceSessions', repo.sessionsByConference, (wsck,)),
+        ('getConferenceSessionsByType', repo.sessionsByConference,
+         (wsck, 'talk')),
+        ('getSessionsBySpeaker', repo.sessionsBySpeaker, ('Speaker 7',)),
+        ('featured speaker check', repo.sessionsBySpeaker,
+         ('Speaker 7', wsck)),
+        ('getSessionsByDate', repo.sessionsByDate, (conf.startDate,)),
+        ('getSessionsByDuration', repo.sessionsByDuration, (45,)),
+        ('getSessionsByTypeTime', repo.sessionsBeforeExcludingType,
+         (time(12), 'workshop')),
+        ('getWishlist', repo.wishlistSessions, (prof,)),
+        ('getProfile', repo.getProfile, ('user1@example.com',)),
+    ]
+
+
+# the repository's batch loads by key (SqliteRepository._load), which
+# stand in for get_multi; SQLite may scan for a long IN list, the
+# datastore does not
+KEY_LOAD = re.compile(r'^SELECT (\*|id, "\w+") FROM \w+ WHERE id IN \(')
+
+
+def flags(plans):
+    """Plan steps worth a look: full scans and sorts without an index.
+    Batch loads by key are left out."""
+    found = []
+    for sql, rows in plans:
+        if KEY_LOAD.match(sql):
+            continue
+        for row in rows:
+            detail = row[-1]
+            if detail.startswith('SCAN') and 'COVERING INDEX' not in detail:
+                found.append(detail)
+            elif 'TEMP B-TREE' in detail:
+                found.append(detail)
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--conferences', type=int, default=5000)
+    parser.add_argument('--sessions', type=int, default=20,
+                        help='sessions per conference')
+    parser.add_argument('--profiles', type=int, default=2000)
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--db', default=':memory:',
+                        help='SQLite file to build (default in memory)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true',
+                        help='print results as JSON')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    if args.db != ':memory:' and os.path.exists(args.db):
+        os.remove(args.db)
+    repo = SqliteRepository(args.db)
+    started = _time.time()
+    confs, _ = load(repo, args, rng)
+    repo.db.execute('ANALYZE')
+    load_s = _time.time() - started
+
+    results = []
+    for name, fn, fn_args in patterns(repo, confs, rng):
+        result, plans = repo.explain(fn, *fn_args)
+        times = []
+        for _ in range(args.runs):
+            start = _time.time()
+            fn(*fn_args)
+            times.append((_time.time() - start) * 1000.0)
+        times.sort()
+        results.append({
+            'pattern': name,
+            'rows': (len(result) if isinstance(result, list)
+                     else int(result is not None)),
+            'median_ms': times[len(times) // 2],
+            # long IN lists shown as '?, ...'
+            'plan': [[re.sub(r'(\?, )+\?', '?, ...', sql),
+                      [row[-1] for row in plan]]
+                     for sql, plan in plans],
+            'flags': flags(plans),
+        })
+
+    if args.json:
+        print(json.dumps({'load_s': load_s, 'config': vars(args),
+                          'patterns': results}, indent=2, sort_keys=True))
+        return
+    print('loaded %d conferences, %d sessions, %d profiles in %.1fs' % (
+        args.conferences, args.conferences * args.sessions, args.profiles,
+        load_s))
+    for result in results:
+        print('\n%-45s %6d rows %9.3f ms%s' % (
+            result['pattern'], result['rows'], result['median_ms'],
+            '  <-- ' + '; '.join(result['flags']) if result['flags'] else ''))
+        for sql, steps in result['plan']:
+            print('  ' + sql)
+            for step in steps:
+                print('    ' + step)
+
+
+if __name__ == '__main__':
+    main()
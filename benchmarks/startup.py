@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+"""startup.py
+
+Cold-start benchmark: import time per application module, each measured
+in a fresh interpreter so earlier imports do not hide the cost of later
+ones. Requires the App Engine Python SDK.
+
+usage: python benchmarks/startup.py --sdk ~/google_appengine [--runs 5]
+       [--json]
+
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# every application module conference.py or main.WARMUP_MODULES loads,
+# dependencies first
+MODULES = ('settings', 'models', 'utils', 'cache', 'ratelimit', 'schedule',
+           'repository', 'ndb_repository', 'facets', 'recommend',
+           'snapshot', 'cascade', 'conference', 'export', 'migrations',
+           'main')
+
+# runs in the child interpreter; prints the import time in milliseconds
+_CHILD = """
+import sys, time
+sys.path.insert(0, %(sdk)r)
+import dev_appserver
+dev_appserver.fix_sys_path()
+sys.path.insert(0, %(root)r)
+start = time.time()
+import %(module)s
+print((time.time() - start) * 1000.0)
+"""
+
+
+def timeImport(sdk, module):
+    """Return the import time of `module` in a fresh interpreter, in ms."""
+    out = subprocess.check_output(
+        [sys.executable, '-c',
+         _CHILD % {'sdk': sdk, 'root': ROOT, 'module': module}],
+        cwd=ROOT)
+    return float(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--sdk', default=os.environ.get('APPENGINE_SDK'),
+                        help='path to the App Engine Python SDK')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--json', action='store_true',
+                        help='print results as JSON')
+    args = parser.parse_args()
+    if not args.sdk:
+        parser.error('--sdk or APPENGINE_SDK is required')
+
+    results = {}
+    for module in MODULES:
+        times = sorted(timeImport(args.sdk, module)
+                       for _ in range(args.runs))
+        results[module] = {'median_ms': times[len(times) // 2],
+                           'min_ms': times[0], 'max_ms': times[-1]}
+
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+        return
+    print('%-16s %10s %10s %10s' % ('module', 'median ms', 'min ms',
+                                     'max ms'))
+    for module in MODULES:
+        r = results[module]
+        print('%-16s %10.1f %10.1f %10.1f' % (
+            module, r['median_ms'], r['min_ms'], r['max_ms']))
+
+
+if __name__ == '__main__':
+    main()
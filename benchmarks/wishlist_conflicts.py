@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+"""wishlist_conflicts.py
+
+Benchmark of wishlist conflict detection: the sort-and-sweep in
+schedule.findOverlaps against a pairwise comparison, on synthetic
+wishlists of sessions spread over a multi-day conference.
+
+usage: python benchmarks/wishlist_conflicts.py [--sizes 100,1000]
+       [--days 3] [--runs 5] [--json]
+
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from schedule import findOverlaps  # noqa: E402
+
+
+def makeIntervals(n, days, seed=0):
+    """Return n sessions of 30-120 minutes starting 08:00-18:00."""
+    rng = random.Random(seed)
+    first = datetime(2026, 3, 10, 8, 0)
+    intervals = []
+    for i in range(n):
+        start = first + timedelta(days=rng.randrange(days),
+                                  minutes=rng.randrange(0, 600, 15))
+        end = start + timedelta(minutes=rng.choice((30, 45, 60, 90, 120)))
+        intervals.append((start, end, i))
+    return intervals
+
+
+def pairwise(intervals):
+    overlaps = []
+    for i, (s1, e1, a) in enumerate(intervals):
+        for s2, e2, b in intervals[i + 1:]:
+            if s1 < e2 and s2 < e1:
+                overlaps.append((a, b))
+    return overlaps
+
+
+def best(fn, arg, runs):
+    times = []
+    for _ in range(runs):
+        start = time.time()
+        result = fn(arg)
+        times.append((time.time() - start) * 1000.0)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--sizes', default='10,100,1000')
+    parser.add_argument('--days', type=int, default=3)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    results = []
+    for n in [int(size) for size in args.sizes.split(',')]:
+        intervals = makeIntervals(n, args.days)
+        sweep_ms, sweep = best(findOverlaps, intervals, args.runs)
+        pair_ms, pairs = best(pairwise, intervals, args.runs)
+        if set(frozenset(p) for p in sweep) != \
+                set(frozenset(p) for p in pairs):
+            raise SystemExit('sweep and pairwise disagree for n=%d' % n)
+        results.append({'sessions': n, 'conflicts': len(sweep),
+                        'sweep_ms': sweep_ms, 'pairwise_ms': pair_ms})
+
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+        return
+    print('%8s %10s %10s %12s' % ('sessions', 'conflicts', 'sweep ms',
+                                  'pairwise ms'))
+    for r in results:
+        print('%8d %10d %10.2f %12.2f' % (r['sessions'], r['conflicts'],
+                                          r['sweep_ms'], r['pairwise_ms']))
+
+
+if __name__ == '__main__':
+    main()
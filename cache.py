@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+"""cache.py
+
+Conference Central two-tier cache: a small per-instance LRU with short
+TTLs in front of memcache, for global keys read on nearly every request.
+Safe to share between the request threads of a threadsafe instance.
+
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from google.appengine.api import memcache
+
+# marks a key known to be absent from memcache (negative cache entry)
+_ABSENT = object()
+
+
+class TwoTierCache(object):
+    """In-process LRU over memcache.
+
+    get() answers from the local tier while an entry is fresh, otherwise
+    reads memcache (and, on a memcache miss, an optional loader). Only one
+    thread per key goes to memcache at a time; concurrent misses for the
+    same key wait for its result. Absent keys are remembered for
+    negative_ttl seconds so they do not cost a round trip either.
+
+    Values set on one instance reach other instances' local tiers when
+    their entries expire, so ttl bounds how stale a read can be.
+    """
+
+    def __init__(self, max_size=128, ttl=10, negative_ttl=5, wait=2):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.wait = wait
+        self._entries = OrderedDict()  # key -> (expires, value)
+        self._loading = {}  # key -> threading.Event
+        self._lock = threading.Lock()
+
+    def _local(self, key):
+        """Return the fresh local value, _ABSENT, or None; hold the lock."""
+        entry = self._entries.pop(key, None)
+        if entry is None or entry[0] < time.time():
+            return None
+        self._entries[key] = entry  # most recently used goes last
+        return entry[1]
+
+    def _store(self, key, value):
+        ttl = self.negative_ttl if value is _ABSENT else self.ttl
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + ttl, value)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get(self, key, loader=None, time_=0):
+        """Return the value for key, or None if it does not exist.
+
+        loader() is called on a memcache miss; a non-None result is written
+        to memcache (expiring after time_ seconds, 0 for never).
+        """
+        while True:
+            with self._lock:
+                value = self._local(key)
+                if value is not None:
+                    return None if value is _ABSENT else value
+                event = self._loading.get(key)
+                if event is None:
+                    event = self._loading[key] = threading.Event()
+                    break
+            # another thread is loading this key; wait, then re-check
+            event.wait(self.wait)
+            with self._lock:
+                if self._loading.get(key) is event:
+                    # the loader is stuck; stop waiting and load ourselves
+                    self._loading.pop(key)
+
+        try:
+            value = memcache.get(key)
+            if value is None and loader is not None:
+                value = loader()
+                if value is not None:
+                    memcache.set(key, value, time=time_)
+            self._store(key, _ABSENT if value is None else value)
+            return value
+        finally:
+            with self._lock:
+                if self._loading.get(key) is event:
+                    del self._loading[key]
+            event.set()
+
+    def set(self, key, value, time_=0):
+        """Write through to memcache and the local tier."""
+        memcache.set(key, value, time=time_)
+        self._store(key, value)
+
+    def delete(self, key):
+        """Delete from memcache; remember locally that the key is absent."""
+        memcache.delete(key)
+        self._store(key, _ABSENT)
+
+    def invalidate(self, key=None):
+        """Drop key (or every key) from the local tier only."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+
+# shared instance for global hot keys (announcement, featured speaker)
+hotCache = TwoTierCache()
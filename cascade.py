@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+
+"""cascade.py
+
+Conference Central background cascade for deleted (tombstoned)
+conferences and sessions. Each task does one bounded step -- a chunk of
+sessions, a page of profiles -- and chains the next, so deleting a large
+conference never holds a request open.
+
+"""
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import Profile
+from models import RegistrationClaim
+from models import Session
+
+import recommend
+
+# session cascades started per task (one task queue batch add)
+SESSION_CHUNK = 100
+# profiles rewritten per task
+PROFILE_BATCH = 100
+# registration claims deleted per task
+CLAIM_CHUNK = 500
+
+# phases of a conference delete, in order
+PHASES = ('sessions', 'attendees', 'claims', 'conference')
+
+# must match conference.MEMCACHE_WISHLIST_INTERVALS_KEY
+MEMCACHE_WISHLIST_INTERVALS_KEY = "WISHLIST_INTERVALS:%s"
+
+
+def enqueueConferenceDelete(wsck, phase=PHASES[0], cursor=None, query=0):
+    params = {'websafeConferenceKey': wsck, 'phase': phase, 'query': query}
+    if cursor:
+        params['cursor'] = cursor
+    taskqueue.add(url='/tasks/cascade_delete', params=params)
+
+
+def _sessionDeleteTask(wssk, cursor=None, query=0):
+    params = {'websafeSessionKey': wssk, 'query': query}
+    if cursor:
+        params['cursor'] = cursor
+    return taskqueue.Task(url='/tasks/cascade_delete', params=params)
+
+
+def enqueueSessionDelete(wssk, cursor=None, query=0):
+    _sessionDeleteTask(wssk, cursor, query).add()
+
+
+def _startCursor(cursor):
+    return Cursor(urlsafe=cursor) if cursor else None
+
+
+def _referencing(prop, key):
+    """Queries for profiles whose repeated key property prop holds key:
+    one on the key references, one on websafe strings left by profiles
+    that the profile_key_references migration has not rewritten yet."""
+    return (Profile.query(prop == key),
+            Profile.query(ndb.GenericProperty(prop._name) == key.urlsafe()))
+
+
+def _rewritePage(queries, query, cursor, scrub):
+    """Apply scrub(profile) -> bool to one page of the profiles matching
+    queries[query], starting at cursor, and put the changed ones. Return
+    (query, cursor) for the next page, or None once every query is done.
+
+    Paging by cursor rather than re-running the query means profiles the
+    (eventually consistent) index still returns after being scrubbed are
+    not seen again, and cannot end the walk early. Each profile is
+    re-read, scrubbed and put in its own transaction, so a registration
+    or wishlist change made since the query ran is not overwritten."""
+    p_keys, next_cursor, more = queries[query].fetch_page(
+        PROFILE_BATCH, start_cursor=_startCursor(cursor), keys_only=True)
+
+    def _scrub(p_key):
+        prof = p_key.get()
+        if not prof or not scrub(prof):
+            return False
+        prof.put()
+        return True
+
+    changed = [p_key for p_key in p_keys
+               if ndb.transaction(lambda: _scrub(p_key))]
+    if changed:
+        memcache.delete_multi([MEMCACHE_WISHLIST_INTERVALS_KEY % k.id()
+                               for k in changed])
+    if more and next_cursor:
+        return query, next_cursor.urlsafe()
+    if query + 1 < len(queries):
+        return query + 1, None
+    return None
+
+
+def deleteSession(wssk, cursor=None, query=0):
+    """Cascade for a deleted session: scrub one page of wishlists per
+    task, then delete the session."""
+    s_key = ndb.Key(urlsafe=wssk)
+
+    def scrub(prof):
+        if s_key not in prof.sessionWishlist:
+            return False
+        prof.sessionWishlist = [k for k in prof.sessionWishlist
+                                if k != s_key]
+        return True
+
+    following = _rewritePage(_referencing(Profile.sessionWishlist, s_key),
+                             query, cursor, scrub)
+    if following:
+        return enqueueSessionDelete(wssk, *following)
+    s_key.delete()
+
+
+def deleteConferenceStep(wsck, phase, cursor=None, query=0):
+    """Run one bounded step of a conference cascade and chain the next."""
+    c_key = ndb.Key(urlsafe=wsck)
+
+    if phase == 'sessions':
+        # sessions hang off ndb.Key(Conference, wsck), see
+        # ConferenceApi._createSessionObject; each gets its own session
+        # cascade for the wishlists
+        s_keys, next_cursor, more = Session.query(
+            ancestor=ndb.Key(Conference, wsck)).fetch_page(
+                SESSION_CHUNK, keys_only=True,
+                start_cursor=_startCursor(cursor))
+        if s_keys:
+            taskqueue.Queue().add([_sessionDeleteTask(k.urlsafe())
+                                   for k in s_keys])
+        if more and next_cursor:
+            return enqueueConferenceDelete(wsck, phase, next_cursor.urlsafe())
+
+    elif phase == 'attendees':
+        def scrub(prof):
+            if c_key not in prof.conferenceKeysToAttend:
+                return False
+            prof.conferenceKeysToAttend.remove(c_key)
+            return True
+        following = _rewritePage(
+            _referencing(Profile.conferenceKeysToAttend, c_key),
+            query, cursor, scrub)
+        if following:
+            return enqueueConferenceDelete(wsck, phase, following[1],
+                                           following[0])
+
+    elif phase == 'claims':
+        claim_keys, next_cursor, more = RegistrationClaim.query(
+            RegistrationClaim.conferenceKey == c_key).fetch_page(
+                CLAIM_CHUNK, keys_only=True,
+                start_cursor=_startCursor(cursor))
+        ndb.delete_multi(claim_keys)
+        if more and next_cursor:
+            return enqueueConferenceDelete(wsck, phase, next_cursor.urlsafe())
+
+    elif phase == 'conference':
+        # the tombstoned entity still holds the topics needed to find the
+        # neighbor lists naming it
+        recommend.removeConference(wsck)
+        ndb.delete_multi([c_key, ndb.Key('SimilarConferences', wsck)])
+        # the deleted conference may be in the announcement
+        taskqueue.add(url='/crons/set_announcement', method='GET')
+        return
+
+    enqueueConferenceDelete(wsck, PHASES[PHASES.index(phase) + 1])
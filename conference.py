@@ -11,16 +11,17 @@ created by wesc on 2014 apr 21
 """
 
 from datetime import datetime
+from datetime import timedelta
+import time
 
-from pprint import pprint
 import endpoints
 from protorpc import messages
 from protorpc import message_types
+from protorpc import protojson
 from protorpc import remote
 
 from google.appengine.api import taskqueue
 from google.appengine.api import memcache
-from google.appengine.api import urlfetch
 from google.appengine.ext import ndb
 
 from models import StringMessage
@@ -28,15 +29,27 @@ from models import BooleanMessage
 from models import Session
 from models import SessionForm
 from models import SessionForms
+from models import SessionConflictForm
+from models import SessionConflictForms
 from models import SessionQueryForm
 from models import SessionQueryForms
 from models import ConflictException
 from models import ConferenceForms
 from models import ConferenceQueryForm
 from models import ConferenceQueryForms
+from models import ConferenceDateRangeQueryForm
+from models import FacetCountForm
+from models import FacetCountForms
+from models import SimilarConferenceForm
+from models import SimilarConferenceForms
 from models import Conference
+from models import DEFAULT_TOPICS
 from models import ConferenceForm
+from models import HomeBundleForm
 from models import Profile
+from models import RegistrationClaim
+from models import RegistrationStatus
+from models import RegistrationStatusForm
 from models import ProfileMiniForm
 from models import ProfileForm
 from models import TeeShirtSize
@@ -44,18 +57,47 @@ from models import TeeShirtSize
 from settings import WEB_CLIENT_ID
 
 from utils import getUserId
+from utils import weekBuckets
+
+import facets
+import recommend
+from cache import hotCache
+from ndb_repository import NdbRepository
+from ratelimit import rateLimited
+from schedule import conflictsWith
+from schedule import findOverlaps
+from schedule import sessionInterval
 
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
 
 MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
 MEMCACHE_SPEAKER_KEY = "FEATURED_SPEAKER"
+MEMCACHE_WISHLIST_INTERVALS_KEY = "WISHLIST_INTERVALS:%s"
+# cached wishlist intervals are updated in place by wishlist changes
+# (compare-and-set, giving up after WISHLIST_CAS_RETRIES) and dropped by
+# session deletes; they also expire as a backstop
+WISHLIST_INTERVALS_TTL = 3600
+WISHLIST_CAS_RETRIES = 3
+
+# admission queue: claims settled per task (one transaction may touch at
+# most 25 entity groups -- the conference plus 24 claims) and the window
+# in seconds used to collapse bursts of settlement tasks into one
+SETTLE_BATCH_SIZE = 24
+SETTLE_INTERVAL = 2
+# pending claims looked at per sweep
+SWEEP_BATCH_SIZE = 1000
+
+# date range queries become one equality subquery per ISO week; the
+# datastore caps IN filters at 30 subqueries
+MAX_RANGE_WEEKS = 30
 
 DEFAULTS = {
     "city": "Default City",
     "maxAttendees": 0,
     "seatsAvailable": 0,
-    "topics": ["Default", "Topic"],
+    "topics": list(DEFAULT_TOPICS),
+    "admissionQueue": False,
 }
 
 SESSION_DEFAULTS = {
@@ -113,6 +155,11 @@ SESS_GET_REQUEST_BY_TYPE_TIME = endpoints.ResourceContainer(
     startTime=messages.StringField(2),
 )
 
+SESS_DELETE_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeSessionKey=messages.StringField(1),
+)
+
 WISHLIST_POST_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     sessionKey=messages.StringField(1),
@@ -128,6 +175,10 @@ WISHLIST_POST_REQUEST = endpoints.ResourceContainer(
 class ConferenceApi(remote.Service):
     """Conference API v0.1"""
 
+    # Conference, Session and Profile storage for the query and simple
+    # write paths; the transactional paths stay on ndb, see repository.py
+    repository = NdbRepository()
+
 # - - - Conference objects - - - - - - - - - - - - - - - - -
 
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
@@ -140,17 +191,16 @@ class ConferenceApi(remote.Service):
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
 
-        # make profile key
-        p_key = ndb.Key(Profile, getUserId(user))
+        user_id = getUserId(user)
         # create ancestor query for this user
-        conferences = Conference.query(ancestor=p_key)
+        conferences = self.repository.conferencesByOrganizer(user_id)
         # get the user profile and display name
-        prof = p_key.get()
+        prof = self.repository.getProfile(user_id)
         displayName = getattr(prof, 'displayName')
         # return set of ConferenceForm objects per Conference
         return ConferenceForms(
             items=[self._copyConferenceToForm(conf, displayName)
-                   for conf in conferences])
+                   for conf in conferences if not conf.deleted])
 
     @endpoints.method(CONF_GET_REQUEST, ConferenceForm,
                       path='conference/{websafeConferenceKey}',
@@ -158,12 +208,12 @@ class ConferenceApi(remote.Service):
     def getConference(self, request):
         """Return requested conference (by websafeConferenceKey)."""
         # get Conference object from request; bail if not found
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
-        if not conf:
+        conf = self.repository.getConference(request.websafeConferenceKey)
+        if not conf or conf.deleted:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s'
                 % request.websafeConferenceKey)
-        prof = conf.key.parent().get()
+        prof = self.repository.getOrganizer(conf)
         # return ConferenceForm
         return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
 
@@ -171,6 +221,7 @@ class ConferenceApi(remote.Service):
                       path='queryConferences',
                       http_method='POST',
                       name='queryConferences')
+    @rateLimited
     def queryConferences(self, request):
         """Query for conferences."""
         conferences = self._getQuery(request)
@@ -178,9 +229,73 @@ class ConferenceApi(remote.Service):
         # return individual ConferenceForm object per Conference
         return ConferenceForms(
                items=[self._copyConferenceToForm(conf, "")
-                      for conf in conferences]
+                      for conf in conferences if not conf.deleted]
         )
 
+    @endpoints.method(CONF_GET_REQUEST, SimilarConferenceForms,
+                      path='conference/{websafeConferenceKey}/similar',
+                      http_method='GET', name='getSimilarConferences')
+    def getSimilarConferences(self, request):
+        """Return conferences with similar topics, most similar first."""
+        similar = ndb.Key(recommend.SimilarConferences,
+                          request.websafeConferenceKey).get()
+        if not similar:
+            return SimilarConferenceForms()
+        # neighbors deleted since the list was written are dropped here
+        # until the delete cascade takes them out of it
+        live = self.repository.getConferences(similar.neighborKeys)
+        return SimilarConferenceForms(items=[
+            SimilarConferenceForm(websafeKey=key, name=name, score=score)
+            for key, name, score, conf in zip(similar.neighborKeys,
+                                              similar.neighborNames,
+                                              similar.scores, live)
+            if conf and not conf.deleted])
+
+    @endpoints.method(message_types.VoidMessage, FacetCountForms,
+                      path='conferenceFacets',
+                      http_method='GET', name='getConferenceFacets')
+    def getConferenceFacets(self, request):
+        """Return conference counts per city, topic and start month."""
+        return FacetCountForms(items=[
+            FacetCountForm(field=field, value=value, count=count)
+            for (field, value), count in sorted(facets.getFacets().items())])
+
+    @endpoints.method(ConferenceDateRangeQueryForm, ConferenceForms,
+                      path='queryConferencesByDateRange',
+                      http_method='POST',
+                      name='queryConferencesByDateRange')
+    @rateLimited
+    def queryConferencesByDateRange(self, request):
+        """Query for conferences running at any time during a date range."""
+        try:
+            start = datetime.strptime(request.startDate[:10],
+                                      "%Y-%m-%d").date()
+            end = datetime.strptime(request.endDate[:10], "%Y-%m-%d").date()
+        except ValueError:
+            raise endpoints.BadRequestException(
+                "startDate and endDate must be YYYY-MM-DD dates.")
+        if end < start:
+            raise endpoints.BadRequestException(
+                "endDate must not be before startDate.")
+        buckets = weekBuckets(start, end)
+        if len(buckets) > MAX_RANGE_WEEKS:
+            raise endpoints.BadRequestException(
+                "Date range may span at most %d weeks." % MAX_RANGE_WEEKS)
+
+        # overlap is a two-inequality query; match the week buckets
+        # instead and drop conferences that only share a partial week
+        seen = set()
+        items = []
+        for conf in self._getQuery(request, buckets):
+            if conf.key in seen or conf.deleted:
+                continue
+            seen.add(conf.key)
+            if conf.startDate <= end and \
+                    max(conf.endDate or conf.startDate,
+                        conf.startDate) >= start:
+                items.append(self._copyConferenceToForm(conf, ""))
+        return ConferenceForms(items=items)
+
     def _copyConferenceToForm(self, conf, displayName):
         """Copy relevant fields from Conference to ConferenceForm."""
         cf = ConferenceForm()
@@ -234,6 +349,7 @@ class ConferenceApi(remote.Service):
         if data['endDate']:
             data['endDate'] = datetime.strptime(data['endDate'][:10],
                                                 "%Y-%m-%d").date()
+        data['weekBuckets'] = weekBuckets(data['startDate'], data['endDate'])
 
         # set seatsAvailable to be same as maxAttendees on creation
         # both for data model & outbound Message
@@ -252,7 +368,11 @@ class ConferenceApi(remote.Service):
 
         # create Conference, send email to organizer confirming
         # creation of Conference & return (modified) ConferenceForm
-        Conference(**data).put()
+        facets.putWithFacets(Conference(**data), 1)
+        recommend.enqueueUpdate(c_key.urlsafe())
+        # imported here; only conference writes need it
+        import snapshot
+        snapshot.enqueueRebuild()
         taskqueue.add(params={'email': user.email(),
                               'conferenceInfo': repr(request)},
                       url='/tasks/send_confirmation_email')
@@ -265,6 +385,36 @@ class ConferenceApi(remote.Service):
         """Create new conference."""
         return self._createConferenceObject(request)
 
+    @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
+                      path='conference/{websafeConferenceKey}/delete',
+                      http_method='DELETE', name='deleteConference')
+    def deleteConference(self, request):
+        """Delete a conference, its sessions and all references to it."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+
+        wsck = request.websafeConferenceKey
+        conf = self.repository.getConference(wsck)
+        if not conf or conf.deleted:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % wsck)
+        if getUserId(user) != conf.organizerUserId:
+            raise endpoints.ForbiddenException(
+                'Only the conference owner can delete the conference')
+
+        # tombstone now, clean up later; the sessions stay until the
+        # cascade reaches them and are hidden by _liveSessions meanwhile
+        if not facets.tombstoneWithFacets(ndb.Key(urlsafe=wsck)):
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % wsck)
+        # imported here; only the delete endpoints need them
+        import cascade
+        import snapshot
+        cascade.enqueueConferenceDelete(wsck)
+        snapshot.enqueueRebuild()
+        return BooleanMessage(data=True)
+
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
                       path='filterPlayground',
                       http_method='GET', name='filterPlayground')
@@ -278,29 +428,27 @@ class ConferenceApi(remote.Service):
         q = q.filter(Conference.month == 6)
 
         return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, "") for conf in q]
+            items=[self._copyConferenceToForm(conf, "") for conf in q
+                   if not conf.deleted]
         )
 
-    def _getQuery(self, request):
-        """Return formatted query from the submitted filters."""
-        q = Conference.query()
+    def _getQuery(self, request, buckets=None):
+        """Return conferences matching the submitted filters (and, given
+        buckets, in any of those weeks)."""
         inequality_filter, filters = self._formatFilters(request.filters)
-
-        # If exists, sort on inequality filter first
-        if not inequality_filter:
-            q = q.order(Conference.name)
-        else:
-            q = q.order(ndb.GenericProperty(inequality_filter))
-            q = q.order(Conference.name)
+        # index.yaml has week bucket indexes for an inequality filter
+        # with at most one equality filter
+        if buckets and inequality_filter and sum(
+                1 for filtr in filters if filtr["operator"] == "=") > 1:
+            raise endpoints.BadRequestException(
+                "Date range queries allow at most one equality filter "
+                "alongside an inequality filter.")
 
         for filtr in filters:
             if filtr["field"] in ["month", "maxAttendees"]:
                 filtr["value"] = int(filtr["value"])
-            formatted_query = ndb.query.FilterNode(filtr["field"],
-                                                   filtr["operator"],
-                                                   filtr["value"])
-            q = q.filter(formatted_query)
-        return q
+        return self.repository.queryConferences(filters, inequality_filter,
+                                                buckets)
 
     def _formatFilters(self, filters):
         """Parse, check validity and format user supplied filters."""
@@ -341,11 +489,10 @@ class ConferenceApi(remote.Service):
     def getConferencesToAttend(self, request):
         """Get list of conferences that user has registered for."""
         prof = self._getProfileFromUser()
-        conf_keys = [ndb.Key(urlsafe=wsck)
-                     for wsck in prof.conferenceKeysToAttend]
-        conferences = ndb.get_multi(conf_keys)
+        conferences = self.repository.conferencesToAttend(prof)
         return ConferenceForms(items=[self._copyConferenceToForm(conf, "")
-                                      for conf in conferences])
+                                      for conf in conferences
+                                      if conf and not conf.deleted])
 
 # - - - Sessions - - - - - - - - - - - - - - - - - - - -
 
@@ -360,8 +507,8 @@ class ConferenceApi(remote.Service):
             raise endpoints.BadRequestException(
                 "Session 'name' field required")
 
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
-        if not conf:
+        conf = self.repository.getConference(request.websafeConferenceKey)
+        if not conf or conf.deleted:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s'
                 % request.websafeConferenceKey)
@@ -374,25 +521,17 @@ class ConferenceApi(remote.Service):
                 for field in request.all_fields()}
         del data['websafeKey']
 
-        c_key = ndb.Key(Conference, request.websafeConferenceKey)
-        s_id = Session.allocate_ids(size=1, parent=c_key)[0]
-        s_key = ndb.Key(Session, s_id, parent=c_key)
-
         data['startTime'] = datetime.strptime(data['startTime'],
                                               '%H:%M').time()
         data['date'] = datetime.strptime(data['date'], '%Y-%m-%d').date()
 
-        data['key'] = s_key
         data['websafeConferenceKey'] = request.websafeConferenceKey
 
         speaker = data['speaker']
 
         # Featured speaker to memcache
-        sessions = Session.query(
-            ndb.AND(
-                Session.speaker == speaker,
-                Session.websafeConferenceKey == request.websafeConferenceKey)
-            ).fetch()
+        sessions = self.repository.sessionsBySpeaker(
+            speaker, request.websafeConferenceKey)
 
         # if speaker is in 1 or more sessions add speaker to memcache
         if len(sessions) > 1:
@@ -400,7 +539,7 @@ class ConferenceApi(remote.Service):
                                  ' Sessions: ' + ', '.join(
                                     sess.name for sess in sessions))
 
-        Session(**data).put()
+        self.repository.createSession(request.websafeConferenceKey, data)
 
         return request
 
@@ -442,8 +581,7 @@ class ConferenceApi(remote.Service):
 
     @staticmethod
     def _cacheSpeaker(sessions):
-        memcache.set(MEMCACHE_SPEAKER_KEY, sessions)
-        print(sessions)
+        hotCache.set(MEMCACHE_SPEAKER_KEY, sessions)
 
     def _speakerToCache(self, sessions):
         taskqueue.add(url='/tasks/set_speaker', params={'sessions': sessions}, method='GET')
@@ -454,22 +592,49 @@ class ConferenceApi(remote.Service):
         """Create new Session."""
         return self._createSessionObject(request)
 
+    @endpoints.method(SESS_DELETE_REQUEST, BooleanMessage,
+                      path='session/{websafeSessionKey}',
+                      http_method='DELETE', name='deleteSession')
+    def deleteSession(self, request):
+        """Delete a session and remove it from all wishlists."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+
+        wssk = request.websafeSessionKey
+        sess = self.repository.getSession(wssk)
+        if not sess or sess.deleted:
+            raise endpoints.NotFoundException(
+                'No session found with key: %s' % wssk)
+        conf = self.repository.getConference(sess.websafeConferenceKey)
+        if not conf or getUserId(user) != conf.organizerUserId:
+            raise endpoints.ForbiddenException(
+                'Only the conference owner can delete its sessions')
+
+        sess.deleted = True
+        self.repository.putSession(sess)
+        # imported here; only the delete endpoints need it
+        import cascade
+        cascade.enqueueSessionDelete(wssk)
+        return BooleanMessage(data=True)
+
     @endpoints.method(CONF_GET_REQUEST, SessionForms,
                       path='conference/{websafeConferenceKey}/sessions',
                       http_method='GET', name='getConferenceSessions')
     def getConferenceSessions(self, request):
         """Return requested Sessions for conference by websafeConferenceKey."""
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
-        if not conf:
+        conf = self.repository.getConference(request.websafeConferenceKey)
+        if not conf or conf.deleted:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s'
                 % request.websafeConferenceKey)
 
-        conf = ndb.Key(Conference, request.websafeConferenceKey)
-        sessions = Session.query(ancestor=conf).fetch()
+        sessions = self.repository.sessionsByConference(
+            request.websafeConferenceKey)
 
         return SessionForms(
-               items=[self._copySessionToForm(s) for s in sessions])
+               items=[self._copySessionToForm(s) for s in sessions
+                      if not s.deleted])
 
     @endpoints.method(SESS_GET_REQUEST_BY_TYPE, SessionForms,
                       path='querySessionsKind', http_method='POST',
@@ -480,89 +645,118 @@ class ConferenceApi(remote.Service):
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
 
-        conf = ndb.Key(Conference, request.websafeConferenceKey)
-        q = Session.query(ancestor=conf).\
-            order(Session.name).\
-            filter(Session.typeOfSession == request.typeOfSession)
+        q = self.repository.sessionsByConference(
+            request.websafeConferenceKey, request.typeOfSession)
 
         return SessionForms(
-               items=[self._copySessionToForm(sess) for sess in q])
+               items=[self._copySessionToForm(sess)
+                      for sess in self._liveSessions(q)])
 
     @endpoints.method(SESS_GET_REQUEST_BY_SPEAKER, SessionForms,
                       path='querySessionsSpeaker', http_method='POST',
                       name='getSessionsBySpeaker')
+    @rateLimited
     def getSessionsBySpeaker(self, request):
         """Query for Sessions"""
         user = endpoints.get_current_user()
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
 
-        q = Session.query().\
-            order(Session.name).\
-            filter(Session.speaker == request.speaker)
+        q = self.repository.sessionsBySpeaker(request.speaker)
 
         return SessionForms(
-               items=[self._copySessionToForm(sess) for sess in q])
+               items=[self._copySessionToForm(sess)
+                      for sess in self._liveSessions(q)])
 
     @endpoints.method(SESS_GET_REQUEST_BY_DATE, SessionForms,
                       path='querySessionsDate', http_method='POST',
                       name='getSessionsByDate')
+    @rateLimited
     def getSessionsByDate(self, request):
         """Query for Sessions by Date."""
         user = endpoints.get_current_user()
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
 
-        q = Session.query().\
-            order(Session.name).\
-            filter(Session.date == datetime.strptime(request.date,
-                                                     '%Y-%m-%d').date())
+        q = self.repository.sessionsByDate(
+            datetime.strptime(request.date, '%Y-%m-%d').date())
 
         return SessionForms(
-               items=[self._copySessionToForm(sess) for sess in q])
+               items=[self._copySessionToForm(sess)
+                      for sess in self._liveSessions(q)])
 
     @endpoints.method(SESS_GET_REQUEST_BY_DURATION, SessionForms,
                       path='querySessionsDuration', http_method='POST',
                       name='getSessionsByDuration')
+    @rateLimited
     def getSessionByDuration(self, request):
         """Query for Sessions by Duration."""
         user = endpoints.get_current_user()
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
 
-        q = Session.query().\
-            order(Session.name).\
-            filter(Session.duration == request.duration)
+        q = self.repository.sessionsByDuration(request.duration)
 
         return SessionForms(
-               items=[self._copySessionToForm(sess) for sess in q])
+               items=[self._copySessionToForm(sess)
+                      for sess in self._liveSessions(q)])
 
     @endpoints.method(SESS_GET_REQUEST_BY_TYPE_TIME, SessionForms,
                       path='querySessionsTypeTime', http_method='POST',
                       name='GetSessionsByTypeTime')
+    @rateLimited
     def getSessionsByTypeTime(self, request):
         """Query for sessions by type and time"""
-        # Use two seprate querys for the inequalites
-        q1 = Session.query(Session.typeOfSession != request.typeOfSession).\
-            fetch(keys_only=True)
-        q2 = Session.query(Session.startTime <
-                           datetime.strptime(request.startTime, '%H:%M').\
-                           time()).fetch(keys_only=True)
-        # Get intersection of resualts to get mutally common resualt.
-        q = ndb.get_multi(set(q1).intersection(q2))
+        q = self.repository.sessionsBeforeExcludingType(
+            datetime.strptime(request.startTime, '%H:%M').time(),
+            request.typeOfSession)
 
         return SessionForms(
-               items=[self._copySessionToForm(sess) for sess in q])
+               items=[self._copySessionToForm(sess)
+                      for sess in self._liveSessions(q)])
+
+    def _liveSessions(self, sessions):
+        """Drop deleted sessions and the sessions of deleted conferences,
+        which stay stored until the delete cascade reaches them."""
+        sessions = [sess for sess in sessions if sess and not sess.deleted]
+        wscks = list(set(sess.websafeConferenceKey for sess in sessions))
+        live = set(wsck for wsck, conf in
+                   zip(wscks, self.repository.getConferences(wscks))
+                   if conf and not conf.deleted)
+        return [sess for sess in sessions
+                if sess.websafeConferenceKey in live]
 
     @endpoints.method(message_types.VoidMessage, StringMessage,
                      path='conference/featured_speaker', http_method='GET',
                      name='getFeaturedSpeaker')
     def getFeaturedSpeaker(self, request):
-        return StringMessage(data=memcache.get(MEMCACHE_SPEAKER_KEY) or "")
+        return StringMessage(data=hotCache.get(MEMCACHE_SPEAKER_KEY) or "")
 
 
 # - - - Session Wishlist - - - - - - - - - - - - - - - - - -
 
+    @staticmethod
+    def _websafeToKey(websafeKey, model):
+        """Decode a websafe key from a request into an ndb.Key, checking
+        its kind; for the registration paths, which stay on ndb."""
+        try:
+            key = ndb.Key(urlsafe=websafeKey)
+        except Exception:
+            key = None
+        if key is None or key.kind() != model._get_kind():
+            raise endpoints.BadRequestException(
+                'Invalid %s key: %s' % (model._get_kind(), websafeKey))
+        return key
+
+    def _sessionKey(self, wssk):
+        """Decode a websafe session key from a request through the
+        repository, so it compares with the keys in sessionWishlist."""
+        s_key = self.repository.sessionKey(wssk)
+        if s_key is None:
+            raise endpoints.BadRequestException(
+                'Invalid Session key: %s' % wssk)
+        return s_key
+
     @endpoints.method(WISHLIST_POST_REQUEST, StringMessage, path='addWishlist',
                       http_method='POST', name='addSessionToWishlist')
     def addSessionToWishlist(self, request):
@@ -571,17 +765,96 @@ class ConferenceApi(remote.Service):
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
         currentUser = self._getProfileFromUser()
+        s_key = self._sessionKey(request.sessionKey)
+        entry = None
 
-        if request.sessionKey in currentUser.sessionWishlist:
+        if s_key in currentUser.sessionWishlist:
             msg = StringMessage(data="Session already in wishlist.")
         else:
-            currentUser.sessionWishlist.append(request.sessionKey)
+            # check the new session against the cached wishlist intervals
+            intervals = self._wishlistIntervals(currentUser)
+            session = (self._liveSessions(
+                [self.repository.getSession(request.sessionKey)]) or
+                [None])[0]
+            if not session:
+                raise endpoints.NotFoundException(
+                    'No session found with key: %s' % request.sessionKey)
+            interval = sessionInterval(session)
+            currentUser.sessionWishlist.append(s_key)
             msg = StringMessage(data="Session added to wishlist.")
-
-        currentUser.put()
+            if interval:
+                conflicts = conflictsWith(interval, intervals)
+                if conflicts:
+                    msg.data += " It overlaps with: %s." % ', '.join(
+                        name for _, name in conflicts)
+                entry = interval + ((request.sessionKey, session.name),)
+
+        self.repository.putProfile(currentUser)
+        if entry:
+            self._updateWishlistIntervals(
+                currentUser, lambda intervals: intervals + [entry])
 
         return msg
 
+    @staticmethod
+    def _updateWishlistIntervals(prof, update):
+        """Replace a profile's cached wishlist intervals by
+        update(intervals) with compare-and-set, so concurrent changes do
+        not overwrite each other. A missing entry is left for the next
+        read to build; one that keeps changing under us is dropped."""
+        client = memcache.Client()
+        cache_key = MEMCACHE_WISHLIST_INTERVALS_KEY % prof.key.id()
+        for _ in range(WISHLIST_CAS_RETRIES):
+            intervals = client.gets(cache_key)
+            if intervals is None:
+                return
+            if client.cas(cache_key, update(intervals),
+                          time=WISHLIST_INTERVALS_TTL):
+                return
+        client.delete(cache_key)
+
+    def _wishlistIntervals(self, prof):
+        """Return [(start, end, (websafeKey, name))] for the sessions in a
+        profile's wishlist, cached in memcache per user."""
+        cache_key = MEMCACHE_WISHLIST_INTERVALS_KEY % prof.key.id()
+        intervals = memcache.get(cache_key)
+        if intervals is None:
+            sessions = self._liveSessions(
+                self.repository.wishlistSessions(prof))
+            intervals = []
+            for sess in sessions:
+                interval = sessionInterval(sess)
+                if interval:
+                    intervals.append(interval + ((sess.key.urlsafe(),
+                                                  sess.name),))
+            # add, not set: never replace an entry a concurrent wishlist
+            # change has just updated
+            memcache.add(cache_key, intervals, time=WISHLIST_INTERVALS_TTL)
+        return intervals
+
+    @endpoints.method(message_types.VoidMessage, SessionConflictForms,
+                      path='wishlistConflicts', http_method='GET',
+                      name='getWishlistConflicts')
+    def getWishlistConflicts(self, request):
+        """Return pairs of wishlist sessions whose times overlap."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        currentUser = self._getProfileFromUser()
+
+        sessions = self._liveSessions(
+            self.repository.wishlistSessions(currentUser))
+        intervals = []
+        for sess in sessions:
+            interval = sessionInterval(sess)
+            if interval:
+                intervals.append(interval + (sess,))
+
+        return SessionConflictForms(items=[
+            SessionConflictForm(first=self._copySessionToForm(a),
+                                second=self._copySessionToForm(b))
+            for a, b in findOverlaps(intervals)])
+
     @endpoints.method(message_types.VoidMessage, SessionForms,
                       path='Wishlist', name='getWishlist')
     def getSessionInWishlist(self, request):
@@ -590,11 +863,11 @@ class ConferenceApi(remote.Service):
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
         currentUser = self._getProfileFromUser()
-        wishlist = currentUser.sessionWishlist
+        wishlist = self.repository.wishlistSessions(currentUser)
 
         return SessionForms(
-               items=[self._copySessionToForm(ndb.Key(urlsafe=sess).get())
-                      for sess in wishlist])
+               items=[self._copySessionToForm(sess)
+                      for sess in self._liveSessions(wishlist)])
 
     @endpoints.method(WISHLIST_POST_REQUEST, StringMessage,
                       path='removeWishlist', http_method='POST',
@@ -605,14 +878,19 @@ class ConferenceApi(remote.Service):
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
         currentUser = self._getProfileFromUser()
+        s_key = self._sessionKey(request.sessionKey)
 
-        if request.sessionKey in currentUser.sessionWishlist:
-            currentUser.sessionWishlist.remove(request.sessionKey)
+        if s_key in currentUser.sessionWishlist:
+            currentUser.sessionWishlist.remove(s_key)
             msg = StringMessage(data="Session removed from wishlist.")
         else:
             msg = StringMessage(data="Session not found in wishlist.")
 
-        currentUser.put()
+        self.repository.putProfile(currentUser)
+        wssk = request.sessionKey
+        self._updateWishlistIntervals(
+            currentUser,
+            lambda intervals: [i for i in intervals if i[2][0] != wssk])
         return msg
 
 # - - - Announcements - - - - - - - - - - - - - - - - - - - -
@@ -620,10 +898,10 @@ class ConferenceApi(remote.Service):
     @staticmethod
     def _cacheAnnouncement():
         """Create Announcement & assign to memcache."""
-        confs = Conference.query(ndb.AND(
+        confs = [conf for conf in Conference.query(ndb.AND(
             Conference.seatsAvailable <= 5,
-            Conference.seatsAvailable > 0)
-        ).fetch(projection=[Conference.name])
+            Conference.seatsAvailable > 0)).fetch()
+            if not conf.deleted]
 
         if confs:
             # If there are almost sold out conferences,
@@ -632,21 +910,48 @@ class ConferenceApi(remote.Service):
                 'Last chance to attend! The following conferences '
                 'are nearly sold out:',
                 ', '.join(conf.name for conf in confs))
-            memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
+            hotCache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
         else:
             # If there are no sold out conferences,
             # delete the memcache announcements entry
             announcement = ""
-            memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
+            hotCache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
 
         return announcement
 
+    @staticmethod
+    def _warmup():
+        """Prime codecs and caches on a new instance (/_ah/warmup)."""
+        # resolve lazily bound field types (e.g. enums named by string)
+        # and run each outbound form through the JSON codec once
+        for form in (ConferenceForm, ConferenceForms, SessionForm,
+                     SessionForms, ProfileForm, StringMessage,
+                     BooleanMessage, HomeBundleForm,
+                     RegistrationStatusForm):
+            for field in form.all_fields():
+                field.type
+            if form().is_initialized():
+                protojson.encode_message(form())
+
+        # fill the instance-local tier for the global hot keys
+        hotCache.get(MEMCACHE_SPEAKER_KEY)
+        if hotCache.get(MEMCACHE_ANNOUNCEMENTS_KEY) is None:
+            ConferenceApi._cacheAnnouncement()
+
+        # nearly sold out conferences draw the registration traffic; load
+        # them into ndb's memcache entity cache
+        hot = Conference.query(ndb.AND(
+            Conference.seatsAvailable <= 5,
+            Conference.seatsAvailable > 0)
+        ).fetch(keys_only=True)
+        ndb.get_multi(hot)
+
     @endpoints.method(message_types.VoidMessage, StringMessage,
                       path='conference/announcement/get',
                       http_method='GET', name='getAnnouncement')
     def getAnnouncement(self, request):
-        """Return Announcement from memcache."""
-        announcement = memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY)
+        """Return Announcement from the instance cache or memcache."""
+        announcement = hotCache.get(MEMCACHE_ANNOUNCEMENTS_KEY)
         if not announcement:
             announcement = ""
         return StringMessage(data=announcement)
@@ -655,59 +960,283 @@ class ConferenceApi(remote.Service):
 # - - - Registration - - - - - - - - - - - - - - - - - - - -
 
     def _conferenceRegistration(self, request, reg=True):
-        """Register or unregister user for selected conference."""
-        retval = None
-        prof = self._getProfileFromUser()  # get user Profile
+        """Register or unregister user for selected conference.
+
+        Registration stays on ndb, in transactions: the profile is only
+        created through the repository here and then re-read by key."""
+        self._getProfileFromUser()  # make sure the user has a Profile
+        p_key = ndb.Key(Profile, getUserId(endpoints.get_current_user()))
 
         # check if conf exists given websafeConfKey
         # get conference; check that it exists
         wsck = request.websafeConferenceKey
         conf = ndb.Key(urlsafe=wsck).get()
-        if not conf:
+        if not conf or conf.deleted:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % wsck)
 
-        # register
+        # popular conferences take registrations through the admission queue
+        if conf.admissionQueue:
+            return self._queuedRegistration(p_key, conf, reg)
+
+        # profile and conference are re-read and written in one
+        # transaction, so neither a concurrent registration nor a
+        # concurrent delete (which sets the tombstone) is overwritten
+        @ndb.transactional(xg=True)
+        def _register():
+            p, c = ndb.get_multi([p_key, conf.key])
+            if not c or c.deleted:
+                raise endpoints.NotFoundException(
+                    'No conference found with key: %s' % wsck)
+
+            # register
+            if reg:
+                # check if user already registered otherwise add
+                if c.key in p.conferenceKeysToAttend:
+                    raise ConflictException(
+                        "You have already registered for this conference")
+
+                # check if seats avail
+                if c.seatsAvailable <= 0:
+                    raise ConflictException(
+                        "There are no seats available.")
+
+                # register user, take away one seat
+                p.conferenceKeysToAttend.append(c.key)
+                c.seatsAvailable -= 1
+
+            # unregister
+            elif c.key in p.conferenceKeysToAttend:
+                # unregister user, add back one seat
+                p.conferenceKeysToAttend.remove(c.key)
+                c.seatsAvailable += 1
+            else:
+                return False
+
+            # write things back to the datastore & return
+            ndb.put_multi([p, c])
+            return True
+
+        return BooleanMessage(data=_register())
+
+    def _queuedRegistration(self, p_key, conf, reg=True):
+        """Record or withdraw a registration claim for an admission-queued
+        conference. The Conference entity itself is only written by the
+        settlement task (and by unregistration), never per request."""
+        wsck = conf.key.urlsafe()
+        claim_key = ndb.Key(RegistrationClaim, '%s:%s' % (wsck, p_key.id()))
+
         if reg:
-            # check if user already registered otherwise add
-            if wsck in prof.conferenceKeysToAttend:
+            if conf.key in p_key.get().conferenceKeysToAttend:
                 raise ConflictException(
                     "You have already registered for this conference")
 
-            # check if seats avail
-            if conf.seatsAvailable <= 0:
+            @ndb.transactional
+            def _claim():
+                if claim_key.get():
+                    return False
+                RegistrationClaim(key=claim_key,
+                                  conferenceKey=conf.key,
+                                  userId=p_key.id(),
+                                  status=str(RegistrationStatus.PENDING)).put()
+                return True
+
+            if not _claim():
                 raise ConflictException(
-                    "There are no seats available.")
+                    "You have already requested a seat for this conference")
+            self._enqueueSettlement(wsck)
+            return BooleanMessage(data=True)
+
+        # unregister; the seat goes back if the profile holds it or if it
+        # was granted and not yet written to the profile. Profile, claim
+        # and conference are re-read and written in one transaction, so
+        # settlement cannot complete the claim half way through.
+        @ndb.transactional(xg=True)
+        def _withdraw():
+            p, claim, c = ndb.get_multi([p_key, claim_key, conf.key])
+            registered = conf.key in p.conferenceKeysToAttend
+            if not (registered or claim):
+                return False, False
+            if registered:
+                p.conferenceKeysToAttend.remove(conf.key)
+                p.put()
+            release = registered or \
+                claim.status == str(RegistrationStatus.GRANTED)
+            if release and c:
+                c.seatsAvailable += 1
+                c.put()
+            if claim:
+                claim_key.delete()
+            return True, release
+
+        withdrawn, released = _withdraw()
+        if released:
+            self._promoteWaitlisted(conf.key)
+        return BooleanMessage(data=withdrawn)
 
-            # register user, take away one seat
-            prof.conferenceKeysToAttend.append(wsck)
-            conf.seatsAvailable -= 1
-            retval = True
+    @staticmethod
+    def _enqueueSettlement(wsck, countdown=SETTLE_INTERVAL):
+        """Schedule settlement for a conference; claims arriving within the
+        same SETTLE_INTERVAL window share one named task."""
+        name = 'settle-%s-%d' % (wsck, int(time.time() / SETTLE_INTERVAL))
+        try:
+            taskqueue.add(url='/tasks/settle_registrations',
+                          params={'websafeConferenceKey': wsck},
+                          name=name, countdown=countdown)
+        except (taskqueue.TaskAlreadyExistsError,
+                taskqueue.TombstonedTaskError):
+            pass
 
-        # unregister
-        else:
-            # check if user already registered
-            if wsck in prof.conferenceKeysToAttend:
+    @staticmethod
+    def _sweepPendingClaims():
+        """Schedule settlement for conferences with claims still PENDING
+        SETTLE_INTERVAL after they were made. The settlement query is
+        eventually consistent, so a task can miss a claim written just
+        before it ran and stop chaining; the sweep picks such claims up."""
+        cutoff = datetime.now() - timedelta(seconds=SETTLE_INTERVAL)
+        claims = RegistrationClaim.query(
+            RegistrationClaim.status == str(RegistrationStatus.PENDING),
+            RegistrationClaim.created < cutoff).fetch(SWEEP_BATCH_SIZE)
+        c_keys = set(claim.conferenceKey for claim in claims)
+        if c_keys:
+            taskqueue.Queue().add([
+                taskqueue.Task(url='/tasks/settle_registrations',
+                               params={'websafeConferenceKey':
+                                       c_key.urlsafe()})
+                for c_key in c_keys])
 
-                # unregister user, add back one seat
-                prof.conferenceKeysToAttend.remove(wsck)
-                conf.seatsAvailable += 1
-                retval = True
-            else:
-                retval = False
+    @staticmethod
+    def _promoteWaitlisted(c_key):
+        """Move the oldest waitlisted claim back to pending and settle."""
+        claim = RegistrationClaim.query(
+            RegistrationClaim.conferenceKey == c_key,
+            RegistrationClaim.status == str(RegistrationStatus.WAITLISTED)
+        ).order(RegistrationClaim.created).get()
+        if claim:
+            claim.status = str(RegistrationStatus.PENDING)
+            claim.put()
+            ConferenceApi._enqueueSettlement(c_key.urlsafe(), countdown=0)
 
-        # write things back to the datastore & return
-        prof.put()
-        conf.put()
-        return BooleanMessage(data=retval)
+    @staticmethod
+    def _settleRegistrations(wsck):
+        """Settle one batch of pending claims for a conference.
+
+        Seats are taken for the whole batch with a single decrement inside
+        one cross-group transaction that also marks the claims GRANTED or
+        WAITLISTED. Each granted claim is then written to its profile and
+        marked REGISTERED in one transaction, so a retried task resumes
+        from whichever step it died in. Returns True if more work remains.
+        """
+        c_key = ndb.Key(urlsafe=wsck)
+        conf = c_key.get()
+        if not conf or conf.deleted:
+            # the delete cascade removes the claims
+            return False
+
+        # finish claims whose seat was taken but profile not yet updated
+        granted = RegistrationClaim.query(
+            RegistrationClaim.conferenceKey == c_key,
+            RegistrationClaim.status == str(RegistrationStatus.GRANTED)
+        ).fetch(SETTLE_BATCH_SIZE)
+        if granted:
+            ConferenceApi._completeGrantedClaims(c_key, granted)
+
+        pending_keys = RegistrationClaim.query(
+            RegistrationClaim.conferenceKey == c_key,
+            RegistrationClaim.status == str(RegistrationStatus.PENDING)
+        ).order(RegistrationClaim.created).fetch(SETTLE_BATCH_SIZE,
+                                                 keys_only=True)
+        if not pending_keys:
+            return len(granted) == SETTLE_BATCH_SIZE
+
+        @ndb.transactional(xg=True)
+        def _allocate():
+            conf = c_key.get()
+            if not conf or conf.deleted:
+                return []
+            # queries are eventually consistent; re-read claims in the txn
+            claims = [c for c in ndb.get_multi(pending_keys)
+                      if c and c.status == str(RegistrationStatus.PENDING)]
+            seats = max(conf.seatsAvailable, 0)
+            taken = min(seats, len(claims))
+            for i, claim in enumerate(claims):
+                claim.status = str(RegistrationStatus.GRANTED if i < taken
+                                   else RegistrationStatus.WAITLISTED)
+            if taken:
+                conf.seatsAvailable -= taken
+                conf.put()
+            ndb.put_multi(claims)
+            return [c for c in claims
+                    if c.status == str(RegistrationStatus.GRANTED)]
+
+        ConferenceApi._completeGrantedClaims(c_key, _allocate())
+        return len(pending_keys) == SETTLE_BATCH_SIZE
+
+    @staticmethod
+    def _completeGrantedClaims(c_key, claims):
+        """Add the conference to the granted users' profiles. Each claim is
+        re-read with its profile in a transaction and completed only if it
+        is still GRANTED; a user who unregistered in the meantime has had
+        the claim deleted and the seat released."""
+        def _complete(claim_key, p_key):
+            claim, prof = ndb.get_multi([claim_key, p_key])
+            if not claim or claim.status != str(RegistrationStatus.GRANTED):
+                return
+            if prof and c_key not in prof.conferenceKeysToAttend:
+                prof.conferenceKeysToAttend.append(c_key)
+                prof.put()
+            claim.status = str(RegistrationStatus.REGISTERED)
+            claim.put()
+
+        for claim in claims:
+            ndb.transaction(
+                lambda: _complete(claim.key, ndb.Key(Profile, claim.userId)),
+                xg=True)
 
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
                       path='conference/{websafeConferenceKey}',
                       http_method='POST', name='registerForConference')
+    @rateLimited
     def registerForConference(self, request):
         """Register user for selected conference."""
         return self._conferenceRegistration(request)
 
+    @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
+                      path='conference/{websafeConferenceKey}',
+                      http_method='DELETE', name='unregisterFromConference')
+    def unregisterFromConference(self, request):
+        """Unregister user for selected conference."""
+        return self._conferenceRegistration(request, reg=False)
+
+    @endpoints.method(CONF_GET_REQUEST, RegistrationStatusForm,
+                      path='conference/{websafeConferenceKey}/registration',
+                      http_method='GET', name='getRegistrationStatus')
+    def getRegistrationStatus(self, request):
+        """Return the user's registration status for a conference."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        user_id = getUserId(user)
+        wsck = request.websafeConferenceKey
+
+        # one batch get: the claim for queued conferences, else the profile
+        c_key = self._websafeToKey(wsck, Conference)
+        conf, claim, prof = ndb.get_multi([
+            c_key, ndb.Key(RegistrationClaim, '%s:%s' % (wsck, user_id)),
+            ndb.Key(Profile, user_id)])
+        if not conf or conf.deleted:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % wsck)
+        if claim:
+            status = getattr(RegistrationStatus, claim.status)
+        else:
+            if prof and c_key in prof.conferenceKeysToAttend:
+                status = RegistrationStatus.REGISTERED
+            else:
+                status = RegistrationStatus.NOT_REGISTERED
+        return RegistrationStatusForm(websafeConferenceKey=wsck,
+                                      status=status)
+
 # - - - Profile objects - - - - - - - - - - - - - - - - - - -
 
     def _copyProfileToForm(self, prof):
@@ -720,6 +1249,11 @@ class ConferenceApi(remote.Service):
                 if field.name == 'teeShirtSize':
                     setattr(pf, field.name, getattr(TeeShirtSize,
                                                     getattr(prof, field.name)))
+                # key references go out as websafe strings
+                elif field.name in ('sessionWishlist',
+                                    'conferenceKeysToAttend'):
+                    setattr(pf, field.name,
+                            [k.urlsafe() for k in getattr(prof, field.name)])
                 else:
                     setattr(pf, field.name, getattr(prof, field.name))
         pf.check_initialized()
@@ -732,16 +1266,14 @@ class ConferenceApi(remote.Service):
             raise endpoints.UnauthorizedException('Authorization required')
 
         user_id = getUserId(user)
-        p_key = ndb.Key(Profile, user_id)
-        profile = p_key.get()
+        profile = self.repository.getProfile(user_id)
         if not profile:
-            profile = Profile(
-                key=p_key,
+            profile = self.repository.createProfile(
+                user_id,
                 displayName=user.nickname(),
                 mainEmail=user.email(),
                 teeShirtSize=str(TeeShirtSize.NOT_SPECIFIED),
             )
-            profile.put()
 
         return profile      # return Profile
 
@@ -757,7 +1289,7 @@ class ConferenceApi(remote.Service):
                     val = getattr(save_request, field)
                     if val:
                         setattr(prof, field, str(val))
-                        prof.put()
+                        self.repository.putProfile(prof)
         return self._copyProfileToForm(prof)
 
     @endpoints.method(message_types.VoidMessage, ProfileForm,
@@ -773,5 +1305,35 @@ class ConferenceApi(remote.Service):
         return self._doProfile(request)
 
 
+# - - - Home page bundle - - - - - - - - - - - - - - - - - -
+
+    @endpoints.method(message_types.VoidMessage, HomeBundleForm,
+                      path='home', http_method='GET', name='getHomeBundle')
+    def getHomeBundle(self, request):
+        """Return profile, conferences to attend and the announcement in
+        one round trip. The datastore reads run concurrently on the ndb
+        event loop; signed-out users get the public parts only. The full
+        conference list is not included (conferences stays empty): clients
+        read it from the cacheable listing snapshot."""
+        user = endpoints.get_current_user()
+
+        # start all independent reads before waiting on any of them; the
+        # announcement usually comes from the instance-local cache tier
+        prof_fut = (ndb.Key(Profile, getUserId(user)).get_async()
+                    if user else None)
+
+        bundle = HomeBundleForm()
+        bundle.announcement = hotCache.get(MEMCACHE_ANNOUNCEMENTS_KEY) or ""
+        if prof_fut:
+            prof = prof_fut.get_result() or self._getProfileFromUser()
+            attend_fut = ndb.get_multi_async(prof.conferenceKeysToAttend)
+            bundle.profile = self._copyProfileToForm(prof)
+            bundle.conferencesToAttend = [
+                self._copyConferenceToForm(f.get_result(), "")
+                for f in attend_fut
+                if f.get_result() and not f.get_result().deleted]
+        return bundle
+
+
 # registers API
 api = endpoints.api_server([ConferenceApi])
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+"""export.py
+
+Conference Central nightly export of Conference, Session and Profile
+entities as gzip-compressed JSONL shards, walked with keys-only cursors
+on chained push-queue tasks.
+
+"""
+
+import gzip
+import json
+import logging
+import time
+from datetime import date
+from datetime import datetime
+from datetime import time as dtime
+from io import BytesIO
+
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+from google.appengine.runtime import DeadlineExceededError
+from google.appengine.runtime import apiproxy_errors
+
+import models  # registers the exported kinds with ndb
+
+EXPORT_KINDS = ('Conference', 'Session', 'Profile')
+# entities fetched and held in memory per shard
+EXPORT_BATCH_SIZE = 500
+# seconds a task keeps writing shards before chaining to the next task
+EXPORT_TASK_BUDGET = 8 * 60
+
+
+class ExportRun(ndb.Model):
+    """ExportRun -- state of one export pipeline run"""
+    status   = ndb.StringProperty(default='RUNNING')
+    started  = ndb.DateTimeProperty(auto_now_add=True)
+    finished = ndb.DateTimeProperty()
+    shards   = ndb.IntegerProperty(default=0)
+    entities = ndb.IntegerProperty(default=0)
+    # position committed with the last shard written
+    kind     = ndb.StringProperty()
+    cursor   = ndb.StringProperty(indexed=False)
+    shard    = ndb.IntegerProperty(default=0)
+
+
+class ExportShard(ndb.Model):
+    """ExportShard -- one gzip JSONL shard; stand-in for a storage bucket
+    object named '<run>/<kind>/<index>.jsonl.gz'"""
+    kind  = ndb.StringProperty()
+    index = ndb.IntegerProperty()
+    count = ndb.IntegerProperty()
+    data  = ndb.BlobProperty()
+
+
+def _jsonDefault(value):
+    """Serialize the non-JSON property types used by the models."""
+    if isinstance(value, (datetime, date, dtime)):
+        return value.isoformat()
+    if isinstance(value, ndb.Key):
+        return value.urlsafe()
+    raise TypeError('Cannot export %r' % value)
+
+
+def _encodeShard(entities):
+    """Return entities as gzip-compressed JSON lines."""
+    buf = BytesIO()
+    gz = gzip.GzipFile(fileobj=buf, mode='wb')
+    for entity in entities:
+        row = entity.to_dict()
+        row['_key'] = entity.key.urlsafe()
+        gz.write(json.dumps(row, default=_jsonDefault, sort_keys=True))
+        gz.write('\n')
+    gz.close()
+    return buf.getvalue()
+
+
+@ndb.transactional(xg=True)
+def _writeShard(run_key, kind, index, count, data, next_cursor):
+    """Store a shard and advance the run past it in one transaction.
+    Shard keys are deterministic, so a retried batch overwrites its
+    earlier attempt and is only counted the first time."""
+    shard_key = ndb.Key(ExportShard, '%s/%s/%05d' % (run_key.id(), kind,
+                                                     index))
+    run = run_key.get()
+    if not shard_key.get():
+        run.shards += 1
+        run.entities += count
+    ExportShard(key=shard_key, kind=kind, index=index, count=count,
+                data=data).put()
+    run.kind = kind
+    run.cursor = next_cursor.urlsafe() if next_cursor else None
+    run.shard = index + 1
+    run.put()
+
+
+def startExport():
+    """Create an ExportRun and enqueue its first batch; return the run."""
+    run = ExportRun()
+    run.put()
+    _enqueueBatch(run.key, 0, None, 0)
+    return run
+
+
+def _enqueueBatch(run_key, kind_index, cursor, shard):
+    taskqueue.add(url='/tasks/export_batch',
+                  params={'run': run_key.id(),
+                          'kind': kind_index,
+                          'cursor': cursor.urlsafe() if cursor else '',
+                          'shard': shard})
+
+
+def exportBatches(run_id, kind_index, cursor, shard):
+    """Export batches for one kind until the task budget runs out, then
+    chain a task that resumes from the last written cursor."""
+    run_key = ndb.Key(ExportRun, run_id)
+    kind = EXPORT_KINDS[kind_index]
+    model = ndb.Model._lookup_model(kind)
+    cursor = Cursor(urlsafe=cursor) if cursor else None
+    deadline = time.time() + EXPORT_TASK_BUDGET
+
+    try:
+        more = True
+        while more and time.time() < deadline:
+            keys, next_cursor, more = model.query().fetch_page(
+                EXPORT_BATCH_SIZE, start_cursor=cursor, keys_only=True)
+            # bypass the caches so the export does not evict hot entities
+            entities = [e for e in ndb.get_multi(keys, use_cache=False,
+                                                 use_memcache=False) if e]
+            if entities:
+                _writeShard(run_key, kind, shard, len(entities),
+                            _encodeShard(entities), next_cursor)
+                shard += 1
+            cursor = next_cursor
+    except (DeadlineExceededError, apiproxy_errors.DeadlineExceededError):
+        # the deadline may land between a shard write and the local
+        # cursor update, so resume from the position stored with the shard
+        more = True
+        run = run_key.get(use_cache=False, use_memcache=False)
+        if run.kind == kind:
+            # no cursor after a written shard means the kind is done
+            more = bool(run.cursor)
+            cursor = Cursor(urlsafe=run.cursor) if run.cursor else None
+            shard = run.shard
+        logging.warning('export %s: deadline in %s at shard %d, chaining',
+                        run_id, kind, shard)
+
+    if more:
+        _enqueueBatch(run_key, kind_index, cursor, shard)
+    elif kind_index + 1 < len(EXPORT_KINDS):
+        _enqueueBatch(run_key, kind_index + 1, None, 0)
+    else:
+        _finish(run_key)
+
+
+@ndb.transactional
+def _finish(run_key):
+    run = run_key.get()
+    run.status = 'DONE'
+    run.finished = datetime.now()
+    run.put()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+
+"""facets.py
+
+Conference Central facet counts (conferences per city, topic and start
+month), kept in sharded counters that are updated in the same transaction
+as the Conference write, so reading them never scans the catalog.
+
+"""
+
+import random
+import time
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import DEFAULT_TOPICS
+
+# counts are cached under the current version, which every write bumps,
+# so a reader that loaded the shards before a write can only fill the
+# entry of a version nobody reads any more
+MEMCACHE_FACETS_KEY = "CONFERENCE_FACETS:%d"
+MEMCACHE_FACETS_VERSION_KEY = "CONFERENCE_FACETS_VERSION"
+# backstop expiry for cached counts
+FACETS_CACHE_TTL = 600
+
+# Conference properties counted, keyed by their conference.FIELDS name
+FACET_FIELDS = {
+    'CITY': 'city',
+    'TOPIC': 'topics',
+    'MONTH': 'month',
+}
+# counter shards per (field, value); spreads writes for popular values
+FACET_SHARDS = 10
+# a cross-group transaction may touch 25 entity groups, one of which is
+# the conference itself
+MAX_TXN_FACETS = 24
+RECONCILE_BATCH_SIZE = 500
+
+
+class FacetShard(ndb.Model):
+    """FacetShard -- one shard of the conference count for a facet value,
+    keyed by '<field>|<value>|<shard>'"""
+    field = ndb.StringProperty()
+    value = ndb.StringProperty()
+    count = ndb.IntegerProperty(default=0, indexed=False)
+
+
+class FacetReconcileRun(ndb.Model):
+    """FacetReconcileRun -- counts accumulated by a reconciliation run"""
+    cursor = ndb.StringProperty(indexed=False)
+    counts = ndb.JsonProperty(default={})
+    started = ndb.DateTimeProperty(auto_now_add=True)
+
+
+def facetPairs(conf):
+    """Return the (field, value) pairs a conference is counted under.
+    The DEFAULT_TOPICS of conferences created without topics are not
+    counted."""
+    pairs = set()
+    for field, prop in FACET_FIELDS.items():
+        values = getattr(conf, prop)
+        if not isinstance(values, list):
+            values = [values]
+        for value in values:
+            if field == 'TOPIC' and value in DEFAULT_TOPICS:
+                continue
+            if value not in (None, '', 0):
+                pairs.add((field, unicode(value)))
+    return sorted(pairs)
+
+
+def _shardKey(field, value, shard):
+    return ndb.Key(FacetShard, u'%s|%s|%d' % (field, value, shard))
+
+
+def _applyDelta(pairs, delta):
+    """Add delta to one random shard of each pair; call in a transaction."""
+    keys = [_shardKey(field, value, random.randint(0, FACET_SHARDS - 1))
+            for field, value in pairs]
+    shards = ndb.get_multi(keys)
+    for i, (field, value) in enumerate(pairs):
+        if shards[i] is None:
+            shards[i] = FacetShard(key=keys[i], field=field, value=value)
+        shards[i].count += delta
+    ndb.put_multi(shards)
+
+
+def putWithFacets(conf, delta):
+    """Put a conference and add delta (+1 created, -1 removed) to its facet
+    counts in one cross-group transaction. Pairs beyond the transaction's
+    entity group limit are applied in follow-up transactions."""
+    pairs = facetPairs(conf)
+
+    @ndb.transactional(xg=True)
+    def _put():
+        conf.put()
+        _applyDelta(pairs[:MAX_TXN_FACETS], delta)
+
+    _put()
+    for i in range(MAX_TXN_FACETS, len(pairs), MAX_TXN_FACETS):
+        chunk = pairs[i:i + MAX_TXN_FACETS]
+        ndb.transaction(lambda: _applyDelta(chunk, delta), xg=True)
+    _invalidate()
+
+
+def tombstoneWithFacets(c_key):
+    """Mark a conference deleted and take it out of the facet counts. The
+    conference is re-read inside the transaction, so concurrent deletes
+    decrement the counts once. Returns False if it was already deleted
+    (or never existed)."""
+    @ndb.transactional(xg=True)
+    def _tombstone():
+        conf = c_key.get()
+        if not conf or conf.deleted:
+            return None
+        conf.deleted = True
+        conf.put()
+        pairs = facetPairs(conf)
+        _applyDelta(pairs[:MAX_TXN_FACETS], -1)
+        return pairs
+
+    pairs = _tombstone()
+    if pairs is None:
+        return False
+    for i in range(MAX_TXN_FACETS, len(pairs), MAX_TXN_FACETS):
+        chunk = pairs[i:i + MAX_TXN_FACETS]
+        ndb.transaction(lambda: _applyDelta(chunk, -1), xg=True)
+    _invalidate()
+    return True
+
+
+def _version():
+    """Return the current cache version. If memcache has lost it, start
+    from the clock, so no entry cached under an earlier one is reused."""
+    version = memcache.get(MEMCACHE_FACETS_VERSION_KEY)
+    if version is None:
+        memcache.add(MEMCACHE_FACETS_VERSION_KEY, int(time.time() * 1000))
+        version = memcache.get(MEMCACHE_FACETS_VERSION_KEY)
+    return version or 0
+
+
+def _invalidate():
+    """Move cached counts to a new version after a write."""
+    if memcache.incr(MEMCACHE_FACETS_VERSION_KEY) is None:
+        _version()
+
+
+def getFacets():
+    """Return {(field, value): count}, from memcache when possible. A miss
+    reads the shards, whose number does not grow with the catalog."""
+    cache_key = MEMCACHE_FACETS_KEY % _version()
+    facets = memcache.get(cache_key)
+    if facets is None:
+        facets = {}
+        for shard in FacetShard.query():
+            pair = (shard.field, shard.value)
+            facets[pair] = facets.get(pair, 0) + shard.count
+        facets = dict((pair, count) for pair, count in facets.items()
+                      if count > 0)
+        memcache.add(cache_key, facets, time=FACETS_CACHE_TTL)
+    return facets
+
+
+# - - - Reconciliation - - - - - - - - - - - - - - - - - - - -
+
+def startReconcile():
+    """Start recomputing all facet counts from the Conference entities."""
+    FacetReconcileRun(id='current').put()
+    taskqueue.add(url='/tasks/reconcile_facets')
+
+
+def reconcileBatch():
+    """Count one batch of conferences; after the last batch overwrite the
+    shards with the recomputed totals. Increments that land while a run
+    is in progress are overwritten too, so run it in quiet hours."""
+    run = FacetReconcileRun.get_by_id('current')
+    if not run:
+        return
+    cursor = Cursor(urlsafe=run.cursor) if run.cursor else None
+    confs, next_cursor, more = Conference.query().fetch_page(
+        RECONCILE_BATCH_SIZE, start_cursor=cursor)
+    for conf in confs:
+        if conf.deleted:
+            continue
+        for field, value in facetPairs(conf):
+            pair = u'%s|%s' % (field, value)
+            run.counts[pair] = run.counts.get(pair, 0) + 1
+
+    if more:
+        run.cursor = next_cursor.urlsafe()
+        run.put()
+        taskqueue.add(url='/tasks/reconcile_facets')
+        return
+
+    # totals go to shard 0; every other existing shard is zeroed
+    shards = FacetShard.query().fetch()
+    for shard in shards:
+        shard.count = 0
+    by_key = dict((shard.key, shard) for shard in shards)
+    for pair, count in run.counts.items():
+        field, value = pair.split(u'|', 1)
+        key = _shardKey(field, value, 0)
+        shard = by_key.setdefault(
+            key, FacetShard(key=key, field=field, value=value))
+        shard.count = count
+    ndb.put_multi(by_key.values())
+    run.key.delete()
+    _invalidate()
@@ -1,12 +1,38 @@
 #!/usr/bin/env python
+import importlib
+import json
+import zlib
+
 import webapp2
 from google.appengine.api import app_identity
 from google.appengine.api import mail
-from conference import ConferenceApi
+from google.appengine.api import taskqueue
+
+# conference (and with it the endpoints framework), facets, export and
+# migrations are imported inside the handlers that need them, so a cold
+# instance serving e.g. a confirmation email task does not pay for them.
+# The warmup request loads all of them ahead of user traffic.
+WARMUP_MODULES = ('models', 'cache', 'conference', 'facets', 'cascade',
+                  'recommend', 'snapshot', 'export', 'migrations')
+
+# snapshot pages never change once written; the pointer to the current
+# version is what goes stale
+LISTING_POINTER_MAX_AGE = 60
+LISTING_PAGE_MAX_AGE = 365 * 24 * 3600
+
+class WarmupHandler(webapp2.RequestHandler):
+    def get(self):
+        """Load modules and prime caches before the instance takes traffic."""
+        for module in WARMUP_MODULES:
+            importlib.import_module(module)
+        from conference import ConferenceApi
+        ConferenceApi._warmup()
+        self.response.set_status(200)
 
 class SetAnnouncementHandler(webapp2.RequestHandler):
     def get(self):
         """Set Announcement in Memcache."""
+        from conference import ConferenceApi
         ConferenceApi._cacheAnnouncement()
         self.response.set_status(204)
 
@@ -26,11 +52,223 @@ class SendConfirmationEmailHandler(webapp2.RequestHandler):
 class SetSpeakerHandler(webapp2.RequestHandler):
     def get(self):
         """ Set featured speaker in  Memcache."""
+        from conference import ConferenceApi
         ConferenceApi._cacheSpeaker(self.request.get('sessions'))
         self.response.set_status(204)
 
+class SettleRegistrationsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Settle a batch of queued registrations, chaining if needed."""
+        from conference import ConferenceApi
+        wsck = self.request.get('websafeConferenceKey')
+        if ConferenceApi._settleRegistrations(wsck):
+            taskqueue.add(url='/tasks/settle_registrations',
+                          params={'websafeConferenceKey': wsck})
+        self.response.set_status(204)
+
+class SweepRegistrationsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Schedule settlement for claims a settlement task missed."""
+        from conference import ConferenceApi
+        ConferenceApi._sweepPendingClaims()
+        self.response.set_status(204)
+
+class StartExportHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start a Conference/Session/Profile export run."""
+        import export
+        run = export.startExport()
+        self.response.headers['Content-Type'] = 'text/plain'
+        self.response.write('export run %s started\n' % run.key.id())
+
+class ExportBatchHandler(webapp2.RequestHandler):
+    def post(self):
+        """Export the next batches of an export run."""
+        import export
+        export.exportBatches(int(self.request.get('run')),
+                             int(self.request.get('kind')),
+                             self.request.get('cursor'),
+                             int(self.request.get('shard')))
+        self.response.set_status(204)
+
+class MigrationAdminHandler(webapp2.RequestHandler):
+    def get(self):
+        """List migration status."""
+        import migrations
+        self.response.headers['Content-Type'] = 'text/plain'
+        for mig in migrations.registeredMigrations():
+            run = migrations.MigrationRun.get_by_id(mig)
+            if run:
+                self.response.write(
+                    '%s: %s qps=%d batches=%d processed=%d changed=%d\n' % (
+                        mig, run.state, run.qps, run.batches,
+                        run.processed, run.changed))
+            else:
+                self.response.write('%s: NOT STARTED\n' % mig)
+
+    def post(self):
+        """Start, pause or resume a migration, then list migration status."""
+        import migrations
+        action = self.request.get('action')
+        name = self.request.get('name')
+        qps = int(self.request.get('qps') or 0) or None
+        if name not in migrations.registeredMigrations():
+            self.abort(404, 'Unknown migration: %s' % name)
+        if action == 'start':
+            migrations.startMigration(name, qps)
+        elif action == 'pause':
+            migrations.pauseMigration(name)
+        elif action == 'resume':
+            migrations.resumeMigration(name, qps)
+        else:
+            self.abort(400, 'Unknown action: %s' % action)
+        self.redirect(self.request.path, code=303)
+
+class MigrateBatchHandler(webapp2.RequestHandler):
+    def post(self):
+        """Apply a migration to its next batch of entities."""
+        import migrations
+        generation = self.request.get('generation')
+        migrations.runBatch(self.request.get('name'),
+                            int(generation) if generation else None)
+        self.response.set_status(204)
+
+class StartReconcileFacetsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start recomputing the conference facet counts."""
+        import facets
+        facets.startReconcile()
+        self.response.set_status(204)
+
+class ReconcileFacetsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Count the next batch of conferences for facet reconciliation."""
+        import facets
+        facets.reconcileBatch()
+        self.response.set_status(204)
+
+class CascadeDeleteHandler(webapp2.RequestHandler):
+    def post(self):
+        """Run one step of a conference or session delete cascade."""
+        import cascade
+        wssk = self.request.get('websafeSessionKey')
+        cursor = self.request.get('cursor') or None
+        query = int(self.request.get('query') or 0)
+        if wssk:
+            cascade.deleteSession(wssk, cursor, query)
+        else:
+            cascade.deleteConferenceStep(
+                self.request.get('websafeConferenceKey'),
+                self.request.get('phase'), cursor, query)
+        self.response.set_status(204)
+
+class RebuildSimilarHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start recomputing similar-conference lists for the whole
+        catalog."""
+        import recommend
+        recommend.startRebuild()
+        self.response.set_status(204)
+
+class RebuildSimilarStepHandler(webapp2.RequestHandler):
+    def post(self):
+        """Run the next step of a similar-conference rebuild."""
+        import recommend
+        recommend.rebuildStep()
+        self.response.set_status(204)
+
+class UpdateSimilarHandler(webapp2.RequestHandler):
+    def post(self):
+        """Add a new conference to the similar-conference lists."""
+        import recommend
+        recommend.addConference(self.request.get('websafeConferenceKey'))
+        self.response.set_status(204)
+
+class StartRebuildListingHandler(webapp2.RequestHandler):
+    def get(self):
+        """Schedule a listing snapshot rebuild (seat counts change without
+        a conference create or delete)."""
+        import snapshot
+        snapshot.enqueueRebuild()
+        self.response.set_status(204)
+
+class RebuildListingHandler(webapp2.RequestHandler):
+    def post(self):
+        """Write a new version of the conference listing snapshot."""
+        import snapshot
+        from conference import ConferenceApi
+        api = ConferenceApi()
+        snapshot.rebuild(lambda conf: api._copyConferenceToForm(conf, ""))
+        self.response.set_status(204)
+
+class ListingPointerHandler(webapp2.RequestHandler):
+    def get(self):
+        """Return the current listing snapshot version and page count."""
+        import snapshot
+        pointer = snapshot.getPointer()
+        if not pointer:
+            self.abort(404, 'No listing snapshot yet')
+        etag = '"%d"' % pointer['version']
+        self.response.headers['Cache-Control'] = (
+            'public, max-age=%d' % LISTING_POINTER_MAX_AGE)
+        self.response.headers['ETag'] = etag
+        if self.request.headers.get('If-None-Match') == etag:
+            self.response.set_status(304)
+            return
+        pointer['pageUrl'] = '/listing/%d/{page}' % pointer['version']
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(pointer))
+
+class ListingPageHandler(webapp2.RequestHandler):
+    def get(self, version, page):
+        """Return one listing snapshot page with a single blob read."""
+        etag = '"%s:%s"' % (version, page)
+        self.response.headers['Cache-Control'] = (
+            'public, max-age=%d, immutable' % LISTING_PAGE_MAX_AGE)
+        self.response.headers['ETag'] = etag
+        if self.request.headers.get('If-None-Match') == etag:
+            self.response.set_status(304)
+            return
+        import snapshot
+        data = snapshot.getPage(int(version), int(page))
+        if data is None:
+            self.abort(404, 'No such listing page')
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.headers['Vary'] = 'Accept-Encoding'
+        if 'gzip' in self.request.headers.get('Accept-Encoding', ''):
+            self.response.headers['Content-Encoding'] = 'gzip'
+        else:
+            data = zlib.decompress(data, 16 + zlib.MAX_WBITS)
+        self.response.write(data)
+
+class RateLimitStatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """List requests rejected by the rate limiter, per method."""
+        import ratelimit
+        self.response.headers['Content-Type'] = 'text/plain'
+        for method, count in sorted(ratelimit.rejectedCounts().items()):
+            self.response.write('%s: %d\n' % (method, count))
+
 app = webapp2.WSGIApplication([
+    ('/_ah/warmup', WarmupHandler),
     ('/crons/set_announcement', SetAnnouncementHandler),
     ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
-    ('/tasks/set_speaker', SetSpeakerHandler)
+    ('/tasks/set_speaker', SetSpeakerHandler),
+    ('/tasks/settle_registrations', SettleRegistrationsHandler),
+    ('/crons/sweep_registrations', SweepRegistrationsHandler),
+    ('/admin/export', StartExportHandler),
+    ('/tasks/export_batch', ExportBatchHandler),
+    ('/admin/migrations', MigrationAdminHandler),
+    ('/tasks/migrate', MigrateBatchHandler),
+    ('/crons/reconcile_facets', StartReconcileFacetsHandler),
+    ('/tasks/reconcile_facets', ReconcileFacetsHandler),
+    ('/admin/ratelimit', RateLimitStatsHandler),
+    ('/tasks/cascade_delete', CascadeDeleteHandler),
+    ('/crons/rebuild_similar', RebuildSimilarHandler),
+    ('/tasks/rebuild_similar', RebuildSimilarStepHandler),
+    ('/tasks/update_similar', UpdateSimilarHandler),
+    ('/crons/rebuild_listing', StartRebuildListingHandler),
+    ('/tasks/rebuild_listing', RebuildListingHandler),
+    ('/listing', ListingPointerHandler),
+    (r'/listing/(\d+)/(\d+)', ListingPageHandler),
 ], debug=True)
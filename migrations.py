@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+
+"""migrations.py
+
+Conference Central schema migration / backfill framework. Registered
+functions are applied to every entity of a model, in keys-only cursor
+batches on chained, throttled push-queue tasks. Each entity is updated
+and marked in its own transaction, so a user write racing the migration
+is retried rather than overwritten, and the marker makes each migration
+idempotent, so runs can be paused, resumed or restarted.
+benchmarks/migration_run.py runs one against the local testbed stubs.
+
+"""
+
+from datetime import datetime
+
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import Profile
+from utils import weekBuckets
+
+# upper bound on entities read per task
+MIGRATION_BATCH_SIZE = 100
+# default entities per second a run may process
+MIGRATION_DEFAULT_QPS = 20
+
+RUNNING = 'RUNNING'
+PAUSED = 'PAUSED'
+DONE = 'DONE'
+
+# name -> (model class, function)
+_REGISTRY = {}
+
+
+def migration(name, model):
+    """Register fn(entity) as migration `name` over all `model` entities.
+    fn updates the entity in place and returns True if it must be saved."""
+    def register(fn):
+        if name in _REGISTRY:
+            raise ValueError('Duplicate migration: %s' % name)
+        _REGISTRY[name] = (model, fn)
+        return fn
+    return register
+
+
+def registeredMigrations():
+    """Return the names of all registered migrations."""
+    return sorted(_REGISTRY)
+
+
+class MigrationRun(ndb.Model):
+    """MigrationRun -- progress and state of a migration, keyed by name"""
+    state      = ndb.StringProperty(default=RUNNING)
+    cursor     = ndb.StringProperty(indexed=False)
+    qps        = ndb.IntegerProperty(default=MIGRATION_DEFAULT_QPS)
+    generation = ndb.IntegerProperty(default=0)
+    batches    = ndb.IntegerProperty(default=0)
+    processed  = ndb.IntegerProperty(default=0)
+    changed    = ndb.IntegerProperty(default=0)
+    started    = ndb.DateTimeProperty()
+    updated    = ndb.DateTimeProperty(auto_now=True)
+
+
+class MigrationMarker(ndb.Model):
+    """MigrationMarker -- records that a migration was applied to one
+    entity, keyed by '<migration>|<websafe entity key>'"""
+    applied = ndb.DateTimeProperty(auto_now_add=True)
+
+
+def _markerKey(name, key):
+    return ndb.Key(MigrationMarker, '%s|%s' % (name, key.urlsafe()))
+
+
+def _enqueue(name, run, countdown=0):
+    """Chain the next batch. Tasks carry the run's generation and runBatch
+    drops those of an older one, so a resume while a batch is in flight
+    cannot leave two chains running."""
+    try:
+        taskqueue.add(url='/tasks/migrate',
+                      params={'name': name, 'generation': run.generation},
+                      name='migrate-%s-%d-%d' % (name, run.generation,
+                                                 run.batches),
+                      countdown=countdown)
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+def startMigration(name, qps=None):
+    """Start (or restart from the beginning) a registered migration.
+    Entities already marked are skipped, so a restart is cheap."""
+    if name not in _REGISTRY:
+        raise KeyError('Unknown migration: %s' % name)
+    run = MigrationRun.get_by_id(name) or MigrationRun(id=name)
+    run.state = RUNNING
+    run.cursor = None
+    run.generation += 1
+    run.batches = run.processed = run.changed = 0
+    run.started = datetime.now()
+    if qps:
+        run.qps = qps
+    run.put()
+    _enqueue(name, run)
+    return run
+
+
+def pauseMigration(name):
+    """Pause a running migration after its current batch."""
+    run = MigrationRun.get_by_id(name)
+    if run and run.state == RUNNING:
+        run.state = PAUSED
+        run.put()
+    return run
+
+
+def resumeMigration(name, qps=None):
+    """Resume a paused migration from its saved cursor."""
+    run = MigrationRun.get_by_id(name)
+    if run and run.state == PAUSED:
+        run.state = RUNNING
+        run.generation += 1
+        if qps:
+            run.qps = qps
+        run.put()
+        _enqueue(name, run)
+    return run
+
+
+def _apply(name, fn, key):
+    """Apply fn to one entity and mark it; run in a transaction."""
+    marker_key = _markerKey(name, key)
+    entity, marker = ndb.get_multi([key, marker_key])
+    if marker or not entity:
+        return False
+    changed = bool(fn(entity))
+    ndb.put_multi(([entity] if changed else []) +
+                  [MigrationMarker(key=marker_key)])
+    return changed
+
+
+def runBatch(name, generation=None):
+    """Apply a migration to one batch of entities and chain the next batch,
+    delayed so the run stays under its configured QPS. A task from an
+    earlier generation of the run is dropped. Returns the number of
+    entities processed."""
+    run = MigrationRun.get_by_id(name)
+    if not run or run.state != RUNNING:
+        return 0
+    if generation is not None and generation != run.generation:
+        return 0
+    model, fn = _REGISTRY[name]
+    batch_size = max(1, min(MIGRATION_BATCH_SIZE, run.qps))
+
+    cursor = Cursor(urlsafe=run.cursor) if run.cursor else None
+    keys, next_cursor, more = model.query().fetch_page(
+        batch_size, start_cursor=cursor, keys_only=True)
+
+    # skip entities this migration has already been applied to
+    markers = ndb.get_multi([_markerKey(name, k) for k in keys])
+    todo = [k for k, m in zip(keys, markers) if m is None]
+    changed = 0
+    for key in todo:
+        if ndb.transaction(lambda: _apply(name, fn, key), xg=True):
+            changed += 1
+
+    run = _recordBatch(name, run.generation, next_cursor if more else None,
+                       len(keys), changed, more)
+    if run and more and run.state == RUNNING:
+        _enqueue(name, run, countdown=float(len(keys)) / run.qps)
+    return len(keys)
+
+
+@ndb.transactional
+def _recordBatch(name, generation, cursor, processed, changed, more):
+    """Save progress; a pause requested mid-batch is preserved. Returns
+    None, saving nothing, if the run was resumed or restarted meanwhile;
+    the new generation's chain redoes the batch, skipping marked
+    entities."""
+    run = MigrationRun.get_by_id(name)
+    if run.generation != generation:
+        return None
+    run.cursor = cursor.urlsafe() if cursor else None
+    run.batches += 1
+    run.processed += processed
+    run.changed += changed
+    if not more:
+        run.state = DONE
+    run.put()
+    return run
+
+
+# - - - Registered migrations - - - - - - - - - - - - - - - -
+
+@migration('conference_admission_queue', Conference)
+def _storeAdmissionQueueFlag(conf):
+    """Write the admissionQueue default onto conferences created before the
+    property existed, so it can be filtered on."""
+    if 'admissionQueue' in conf._values:
+        return False
+    conf.admissionQueue = False
+    return True
+
+
+@migration('conference_week_buckets', Conference)
+def _backfillWeekBuckets(conf):
+    """Index existing conferences for queryConferencesByDateRange."""
+    buckets = weekBuckets(conf.startDate, conf.endDate)
+    if conf.weekBuckets == buckets:
+        return False
+    conf.weekBuckets = buckets
+    return True
+
+
+@migration('profile_key_references', Profile)
+def _storeKeyReferences(prof):
+    """Rewrite conferenceKeysToAttend and sessionWishlist, which older
+    profiles hold as websafe strings, as key references. Values are read
+    as keys either way, so every profile holding any is saved again;
+    strings that are not valid keys were dropped on load, and saving the
+    profile removes them."""
+    return bool(prof.conferenceKeysToAttend or prof.sessionWishlist or
+                getattr(prof, '_droppedReferences', 0))
@@ -11,10 +11,16 @@ created/forked from conferences.py by wesc on 2014 may 24
 """
 
 import httplib
+import logging
 import endpoints
 from protorpc import messages
 from google.appengine.ext import ndb
 
+# topics given to conferences created without any (conference.DEFAULTS);
+# they say nothing about a conference, so facet counts and similarity
+# scores leave them out
+DEFAULT_TOPICS = ('Default', 'Topic')
+
 
 class Conference(ndb.Model):
     """Conference -- Conference object"""
@@ -28,6 +34,11 @@ class Conference(ndb.Model):
     endDate         = ndb.DateProperty()
     maxAttendees    = ndb.IntegerProperty()
     seatsAvailable  = ndb.IntegerProperty()
+    admissionQueue  = ndb.BooleanProperty(default=False)
+    # ISO weeks (year * 100 + week) spanned by startDate..endDate
+    weekBuckets     = ndb.IntegerProperty(repeated=True)
+    # tombstone; set on delete, entity removed by the cascade task
+    deleted         = ndb.BooleanProperty(default=False)
 
 
 class ConferenceForm(messages.Message):
@@ -44,6 +55,7 @@ class ConferenceForm(messages.Message):
     endDate         = messages.StringField(10)
     websafeKey      = messages.StringField(11)
     organizerDisplayName = messages.StringField(12)
+    admissionQueue  = messages.BooleanField(13)
 
 
 class ConferenceForms(messages.Message):
@@ -63,6 +75,38 @@ class ConferenceQueryForms(messages.Message):
     filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
 
 
+class FacetCountForm(messages.Message):
+    """FacetCountForm -- number of conferences for one filter value"""
+    field = messages.StringField(1)
+    value = messages.StringField(2)
+    count = messages.IntegerField(3)
+
+
+class FacetCountForms(messages.Message):
+    """FacetCountForms -- multiple FacetCountForm outbound form message"""
+    items = messages.MessageField(FacetCountForm, 1, repeated=True)
+
+
+class SimilarConferenceForm(messages.Message):
+    """SimilarConferenceForm -- conference recommended by topic overlap"""
+    websafeKey = messages.StringField(1)
+    name = messages.StringField(2)
+    score = messages.FloatField(3)
+
+
+class SimilarConferenceForms(messages.Message):
+    """SimilarConferenceForms -- multiple SimilarConferenceForm outbound form message"""
+    items = messages.MessageField(SimilarConferenceForm, 1, repeated=True)
+
+
+class ConferenceDateRangeQueryForm(messages.Message):
+    """ConferenceDateRangeQueryForm -- conferences running during a date
+    range, optionally narrowed by ConferenceQueryForm filters"""
+    startDate = messages.StringField(1, required=True)
+    endDate = messages.StringField(2, required=True)
+    filters = messages.MessageField(ConferenceQueryForm, 3, repeated=True)
+
+
 class Session(ndb.Model):
     """Session -- Session object"""
     name          = ndb.StringProperty(required=True)
@@ -73,6 +117,7 @@ class Session(ndb.Model):
     date          = ndb.DateProperty()
     startTime     = ndb.TimeProperty()
     websafeConferenceKey = ndb.StringProperty()
+    deleted       = ndb.BooleanProperty(default=False)
 
 class SessionForm(messages.Message):
     """SessionForm -- Session outbound form message"""
@@ -90,6 +135,15 @@ class SessionForms(messages.Message):
     """SessionForms -- multiple Sessions outbound form message"""
     items = messages.MessageField(SessionForm, 1, repeated=True)
 
+class SessionConflictForm(messages.Message):
+    """SessionConflictForm -- pair of sessions whose times overlap"""
+    first = messages.MessageField(SessionForm, 1)
+    second = messages.MessageField(SessionForm, 2)
+
+class SessionConflictForms(messages.Message):
+    """SessionConflictForms -- multiple SessionConflictForm outbound form message"""
+    items = messages.MessageField(SessionConflictForm, 1, repeated=True)
+
 class SessionQueryForm(messages.Message):
     """SessionQueryForm -- Session query inbound form message"""
     field = messages.StringField(1)
@@ -106,23 +160,83 @@ class BooleanMessage(messages.Message):
     data = messages.BooleanField(1)
 
 
+class RegistrationClaim(ndb.Model):
+    """RegistrationClaim -- pending seat request for an admission-queued
+    conference, keyed by '<websafeConferenceKey>:<userId>'"""
+    conferenceKey = ndb.KeyProperty(kind='Conference', required=True)
+    userId        = ndb.StringProperty(required=True)
+    status        = ndb.StringProperty(required=True)
+    created       = ndb.DateTimeProperty(auto_now_add=True)
+
+
+class RegistrationStatus(messages.Enum):
+    """RegistrationStatus -- registration state enumeration value"""
+    NOT_REGISTERED = 1
+    PENDING = 2
+    GRANTED = 3
+    REGISTERED = 4
+    WAITLISTED = 5
+
+
+class RegistrationStatusForm(messages.Message):
+    """RegistrationStatusForm -- outbound registration status message"""
+    websafeConferenceKey = messages.StringField(1)
+    status = messages.EnumField('RegistrationStatus', 2)
+
+
 class ConflictException(endpoints.ServiceException):
     """ConflictException -- exception mapped to HTTP 409 response"""
     http_status = httplib.CONFLICT
 
 
+class TooManyRequestsException(endpoints.ServiceException):
+    """TooManyRequestsException -- exception mapped to HTTP 429 response"""
+    http_status = 429
+
+
 class StringMessage(messages.Message):
     """StringMessage-- outbound (single) string message"""
     data = messages.StringField(1, required=True)
 
 
+class WebsafeKeyProperty(ndb.KeyProperty):
+    """WebsafeKeyProperty -- KeyProperty that also reads values stored as
+    websafe key strings, the format used before it replaced StringProperty;
+    such entities are rewritten as key references on their next put.
+    Strings that do not decode to a key of the property's kind (the old
+    wishlist stored request values unchecked) are dropped and counted in
+    the entity's _droppedReferences, so the entity still loads."""
+
+    def _db_get_value(self, v, p):
+        if v.has_stringvalue():
+            try:
+                key = ndb.Key(urlsafe=v.stringvalue())
+            except Exception:
+                key = None
+            if key is None or (self._kind and key.kind() != self._kind):
+                logging.warning('%s: dropping invalid key %r',
+                                self._name, v.stringvalue())
+                return None
+            return key
+        return super(WebsafeKeyProperty, self)._db_get_value(v, p)
+
+    def _deserialize(self, entity, p, *args):
+        super(WebsafeKeyProperty, self)._deserialize(entity, p, *args)
+        values = self._retrieve_value(entity)
+        if self._repeated and values and values[-1] is None:
+            values.pop()
+            entity._droppedReferences = \
+                getattr(entity, '_droppedReferences', 0) + 1
+
+
 class Profile(ndb.Model):
     """Profile -- User profile object"""
     displayName = ndb.StringProperty()
     mainEmail = ndb.StringProperty()
     teeShirtSize = ndb.StringProperty(default='NOT_SPECIFIED')
-    conferenceKeysToAttend = ndb.StringProperty(repeated=True)
-    sessionWishlist = ndb.StringProperty(repeated=True)
+    conferenceKeysToAttend = WebsafeKeyProperty(kind='Conference',
+                                                repeated=True)
+    sessionWishlist = WebsafeKeyProperty(kind='Session', repeated=True)
 
 
 class ProfileMiniForm(messages.Message):
@@ -138,6 +252,17 @@ class ProfileForm(messages.Message):
     mainEmail = messages.StringField(3)
     teeShirtSize = messages.EnumField('TeeShirtSize', 4)
     sessionWishlist = messages.StringField(5, repeated=True)
+    conferenceKeysToAttend = messages.StringField(6, repeated=True)
+
+
+class HomeBundleForm(messages.Message):
+    """HomeBundleForm -- outbound composite message for the first page load"""
+    profile = messages.MessageField(ProfileForm, 1)
+    # no longer filled; the list comes from the listing snapshot
+    conferences = messages.MessageField(ConferenceForm, 2, repeated=True)
+    conferencesToAttend = messages.MessageField(ConferenceForm, 3,
+                                                repeated=True)
+    announcement = messages.StringField(4)
 
 class TeeShirtSize(messages.Enum):
     """TeeShirtSize -- t-shirt size enumeration value"""
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+"""ndb_repository.py
+
+Conference Central repository on the App Engine datastore (ndb); the
+queries are the ones ConferenceApi ran before the repository existed.
+
+"""
+
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import Profile
+from models import Session
+from repository import Repository
+
+
+class NdbRepository(Repository):
+    """Repository backed by ndb."""
+
+    # - - - Conferences - - - - - - - - - - - - - - - - - - - -
+
+    def getConference(self, wsck):
+        return ndb.Key(urlsafe=wsck).get()
+
+    def getConferences(self, wscks):
+        return ndb.get_multi([ndb.Key(urlsafe=wsck) for wsck in wscks])
+
+    def getOrganizer(self, conf):
+        return conf.key.parent().get()
+
+    def conferencesByOrganizer(self, user_id):
+        return Conference.query(ancestor=ndb.Key(Profile, user_id))
+
+    def queryConferences(self, filters, inequality_field=None,
+                         weekBuckets=None):
+        q = Conference.query()
+        # If exists, sort on inequality filter first
+        if inequality_field:
+            q = q.order(ndb.GenericProperty(inequality_field))
+        q = q.order(Conference.name)
+
+        for filtr in filters:
+            q = q.filter(ndb.query.FilterNode(filtr["field"],
+                                              filtr["operator"],
+                                              filtr["value"]))
+        if weekBuckets:
+            q = q.filter(Conference.weekBuckets.IN(weekBuckets))
+        return q
+
+    def conferencesToAttend(self, prof):
+        return ndb.get_multi(prof.conferenceKeysToAttend)
+
+    # - - - Sessions - - - - - - - - - - - - - - - - - - - - -
+
+    def getSession(self, wssk):
+        return ndb.Key(urlsafe=wssk).get()
+
+    def createSession(self, wsck, data):
+        # sessions hang off ndb.Key(Conference, wsck), not the conference
+        # key itself; cascade.py and the export rely on it
+        c_key = ndb.Key(Conference, wsck)
+        s_id = Session.allocate_ids(size=1, parent=c_key)[0]
+        sess = Session(key=ndb.Key(Session, s_id, parent=c_key), **data)
+        sess.put()
+        return sess
+
+    def putSession(self, sess):
+        sess.put()
+
+    def sessionsByConference(self, wsck, typeOfSession=None):
+        q = Session.query(ancestor=ndb.Key(Conference, wsck))
+        if typeOfSession is not None:
+            q = q.order(Session.name).\
+                filter(Session.typeOfSession == typeOfSession)
+        return q.fetch()
+
+    def sessionsBySpeaker(self, speaker, wsck=None):
+        if wsck is not None:
+            return Session.query(ndb.AND(
+                Session.speaker == speaker,
+                Session.websafeConferenceKey == wsck)).fetch()
+        return Session.query(Session.speaker == speaker).order(Session.name)
+
+    def sessionsByDate(self, date):
+        return Session.query(Session.date == date).order(Session.name)
+
+    def sessionsByDuration(self, duration):
+        return Session.query(Session.duration == duration).\
+            order(Session.name)
+
+    def sessionsBeforeExcludingType(self, startTime, typeOfSession):
+        # two inequalities on different properties cannot share a
+        # datastore query; intersect two keys-only queries instead
+        q1 = Session.query(Session.typeOfSession != typeOfSession).\
+            fetch(keys_only=True)
+        q2 = Session.query(Session.startTime < startTime).\
+            fetch(keys_only=True)
+        return ndb.get_multi(set(q1).intersection(q2))
+
+    def sessionKey(self, wssk):
+        try:
+            key = ndb.Key(urlsafe=wssk)
+        except Exception:
+            return None
+        return key if key.kind() == Session._get_kind() else None
+
+    def wishlistSessions(self, prof):
+        return ndb.get_multi(prof.sessionWishlist)
+
+    # - - - Profiles - - - - - - - - - - - - - - - - - - - - -
+
+    def getProfile(self, user_id):
+        return ndb.Key(Profile, user_id).get()
+
+    def createProfile(self, user_id, **fields):
+        prof = Profile(key=ndb.Key(Profile, user_id), **fields)
+        prof.put()
+        return prof
+
+    def putProfile(self, prof):
+        prof.put()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+"""ratelimit.py
+
+Conference Central per-caller rate limiting for ConferenceApi methods.
+Token buckets live in memcache as counters keyed by caller, method and
+fixed time window; spending tokens is one atomic offset_multi call.
+
+"""
+
+import functools
+import time
+
+import endpoints
+from google.appengine.api import memcache
+
+from models import TooManyRequestsException
+from settings import RATE_LIMIT_CAPACITY
+from settings import RATE_LIMIT_COSTS
+from settings import RATE_LIMIT_USER_CAPACITY
+from settings import RATE_LIMIT_WINDOW
+
+MEMCACHE_NAMESPACE = 'ratelimit'
+
+
+def _caller(service):
+    """Identify the caller by account, or by address when signed out."""
+    user = endpoints.get_current_user()
+    if user:
+        return user.email()
+    return 'ip:%s' % service.request_state.remote_address
+
+
+def _spend(caller, method):
+    """Take the method's cost from the caller's per-method and overall
+    buckets; return False if either bucket is exhausted."""
+    cost = RATE_LIMIT_COSTS.get(method, 1)
+    window = int(time.time() / RATE_LIMIT_WINDOW)
+    method_key = '%s|%s|%d' % (caller, method, window)
+    user_key = '%s|*|%d' % (caller, window)
+    counts = memcache.offset_multi({method_key: cost, user_key: cost},
+                                   namespace=MEMCACHE_NAMESPACE,
+                                   initial_value=0)
+    # counts are missing if memcache is unavailable; fail open
+    return (counts.get(method_key) or 0) <= RATE_LIMIT_CAPACITY and \
+        (counts.get(user_key) or 0) <= RATE_LIMIT_USER_CAPACITY
+
+
+def rejectedCounts():
+    """Return {method: requests rejected} for the configured methods."""
+    counts = memcache.get_multi(['rejected|%s' % m for m in RATE_LIMIT_COSTS],
+                                namespace=MEMCACHE_NAMESPACE)
+    return dict((m, counts.get('rejected|%s' % m, 0))
+                for m in RATE_LIMIT_COSTS)
+
+
+def rateLimited(method):
+    """Decorate a ConferenceApi method (below @endpoints.method) so that
+    callers over their budget get a 429 TooManyRequestsException."""
+    @functools.wraps(method)
+    def wrapper(self, request):
+        if not _spend(_caller(self), method.__name__):
+            memcache.incr('rejected|%s' % method.__name__,
+                          namespace=MEMCACHE_NAMESPACE, initial_value=0)
+            raise TooManyRequestsException(
+                'Rate limit exceeded, retry in %d seconds.'
+                % RATE_LIMIT_WINDOW)
+        return method(self, request)
+    return wrapper
@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+
+"""recommend.py
+
+Conference Central "you might also like" recommendations: the top-K
+conferences by Jaccard similarity of their topics, precomputed in the
+background and stored as one compact neighbor list per conference.
+
+"""
+
+import heapq
+import zlib
+from datetime import datetime
+
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import DEFAULT_TOPICS
+
+# neighbors kept per conference
+SIMILAR_K = 5
+# above this many conferences candidates come from MinHash LSH buckets
+# instead of the topic inverted index, whose postings get too long
+MINHASH_THRESHOLD = 5000
+# 16 bands of 2 rows make pairs with Jaccard similarity above ~0.25
+# likely to share a bucket
+MINHASH_BANDS = 16
+MINHASH_ROWS = 2
+BUILD_BATCH_SIZE = 500
+# conferences whose lists one rebuild task computes
+SCORE_BATCH_SIZE = 1000
+# conferences sharing a topic considered by an incremental update
+INCREMENTAL_CANDIDATES = 1000
+
+
+class SimilarConferences(ndb.Model):
+    """SimilarConferences -- top-K similar conferences for the conference
+    whose websafe key is this entity's id, best first"""
+    neighborKeys  = ndb.StringProperty(repeated=True, indexed=False)
+    neighborNames = ndb.StringProperty(repeated=True, indexed=False)
+    scores        = ndb.FloatProperty(repeated=True, indexed=False)
+    updated       = ndb.DateTimeProperty(auto_now=True)
+
+
+def topicSet(conf):
+    """A conference's topics for similarity, without the DEFAULT_TOPICS
+    given to conferences created without any."""
+    return frozenset(conf.topics) - frozenset(DEFAULT_TOPICS)
+
+
+def jaccard(a, b):
+    """Jaccard similarity of two topic sets."""
+    if not a or not b:
+        return 0.0
+    return float(len(a & b)) / len(a | b)
+
+
+def _minhash(topics):
+    """MinHash signature of a topic set, one minimum per hash function."""
+    encoded = [t.encode('utf-8') for t in topics]
+    return tuple(min(zlib.crc32('%d:%s' % (i, t)) & 0xffffffff
+                     for t in encoded)
+                 for i in range(MINHASH_BANDS * MINHASH_ROWS))
+
+
+def _topK(wsck, topics, candidates, catalog):
+    """Return [(score, wsck)] of the best SIMILAR_K candidates."""
+    scored = ((jaccard(topics, catalog[c][1]), c)
+              for c in candidates if c != wsck)
+    return heapq.nlargest(SIMILAR_K, (s for s in scored if s[0] > 0))
+
+
+def _neighborsEntity(wsck, top, catalog):
+    return SimilarConferences(id=wsck,
+                              neighborKeys=[c for _, c in top],
+                              neighborNames=[catalog[c][0] for _, c in top],
+                              scores=[s for s, _ in top])
+
+
+def _candidateSets(catalog, wscks):
+    """Yield (wsck, candidate keys) for each of wscks: conferences in the
+    catalog that share a topic, or for large catalogs that share a
+    MinHash LSH band."""
+    if len(catalog) <= MINHASH_THRESHOLD:
+        postings = {}
+        for wsck, (_, topics) in catalog.items():
+            for topic in topics:
+                postings.setdefault(topic, []).append(wsck)
+        for wsck in wscks:
+            candidates = set()
+            for topic in catalog[wsck][1]:
+                candidates.update(postings[topic])
+            yield wsck, candidates
+        return
+
+    buckets = {}
+    bands = {}
+    for wsck, (_, topics) in catalog.items():
+        sig = _minhash(topics)
+        bands[wsck] = [(b, sig[b * MINHASH_ROWS:(b + 1) * MINHASH_ROWS])
+                       for b in range(MINHASH_BANDS)]
+        for band in bands[wsck]:
+            buckets.setdefault(band, []).append(wsck)
+    for wsck in wscks:
+        candidates = set()
+        for band in bands[wsck]:
+            candidates.update(buckets[band])
+        yield wsck, candidates
+
+
+# - - - Full rebuild - - - - - - - - - - - - - - - - - - - -
+
+class SimilarRebuildRun(ndb.Model):
+    """SimilarRebuildRun -- progress of a full rebuild, keyed 'current'.
+    Phases: 'load' copies the catalog into SimilarCatalogPage entities a
+    batch per task, 'score' computes the lists of SCORE_BATCH_SIZE
+    conferences per task, 'cleanup' deletes lists not written by it."""
+    phase   = ndb.StringProperty(default='load', indexed=False)
+    cursor  = ndb.StringProperty(indexed=False)
+    pages   = ndb.IntegerProperty(default=0, indexed=False)
+    offset  = ndb.IntegerProperty(default=0, indexed=False)
+    started = ndb.DateTimeProperty(indexed=False)
+
+
+class SimilarCatalogPage(ndb.Model):
+    """SimilarCatalogPage -- one batch of the catalog copied by a rebuild,
+    [[websafeKey, name, topics]], keyed by page number"""
+    entries = ndb.JsonProperty(compressed=True, indexed=False)
+
+
+def startRebuild():
+    """Start recomputing the neighbor lists of every conference."""
+    SimilarRebuildRun(id='current', started=datetime.now()).put()
+    taskqueue.add(url='/tasks/rebuild_similar')
+
+
+def _loadCatalog(pages):
+    """Return {websafeKey: (name, frozenset(topics))} from a rebuild's
+    catalog pages."""
+    catalog = {}
+    for page in ndb.get_multi([ndb.Key(SimilarCatalogPage, i + 1)
+                               for i in range(pages)]):
+        for wsck, name, topics in page.entries:
+            catalog[wsck] = (name, frozenset(topics))
+    return catalog
+
+
+def rebuildStep():
+    """Run one bounded step of a full rebuild and chain the next. Each step
+    writes its results before saving progress, so a retried task redoes
+    the same step."""
+    run = SimilarRebuildRun.get_by_id('current')
+    if not run:
+        return
+
+    if run.phase == 'load':
+        cursor = Cursor(urlsafe=run.cursor) if run.cursor else None
+        confs, next_cursor, more = Conference.query().fetch_page(
+            BUILD_BATCH_SIZE, start_cursor=cursor)
+        entries = [[conf.key.urlsafe(), conf.name, sorted(topicSet(conf))]
+                   for conf in confs
+                   if not conf.deleted and topicSet(conf)]
+        SimilarCatalogPage(id=run.pages + 1, entries=entries).put()
+        run.pages += 1
+        if more and next_cursor:
+            run.cursor = next_cursor.urlsafe()
+        else:
+            run.phase, run.cursor = 'score', None
+
+    elif run.phase == 'score':
+        catalog = _loadCatalog(run.pages)
+        wscks = sorted(catalog)[run.offset:run.offset + SCORE_BATCH_SIZE]
+        ndb.put_multi([
+            _neighborsEntity(wsck,
+                             _topK(wsck, catalog[wsck][1], candidates,
+                                   catalog),
+                             catalog)
+            for wsck, candidates in _candidateSets(catalog, wscks)])
+        run.offset += SCORE_BATCH_SIZE
+        if run.offset >= len(catalog):
+            run.phase = 'cleanup'
+
+    else:
+        # lists of conferences deleted since the last build
+        stale = SimilarConferences.query(
+            SimilarConferences.updated < run.started).fetch(
+                BUILD_BATCH_SIZE, keys_only=True)
+        if stale:
+            ndb.delete_multi(stale)
+        else:
+            ndb.delete_multi([ndb.Key(SimilarCatalogPage, i + 1)
+                              for i in range(run.pages)] + [run.key])
+            return
+
+    run.put()
+    taskqueue.add(url='/tasks/rebuild_similar')
+
+
+def enqueueUpdate(wsck):
+    taskqueue.add(url='/tasks/update_similar',
+                  params={'websafeConferenceKey': wsck})
+
+
+def addConference(wsck):
+    """Incremental update for a new conference: compute its neighbors from
+    conferences sharing a topic and insert it into their lists where it
+    beats their current K-th neighbor."""
+    conf = ndb.Key(urlsafe=wsck).get()
+    if not conf or conf.deleted or not topicSet(conf):
+        return
+    topics = topicSet(conf)
+    # the datastore caps IN filters at 30 values
+    others = Conference.query(
+        Conference.topics.IN(list(topics)[:30])).fetch(INCREMENTAL_CANDIDATES)
+    catalog = {wsck: (conf.name, topics)}
+    for other in others:
+        if not other.deleted and topicSet(other):
+            catalog[other.key.urlsafe()] = (other.name, topicSet(other))
+
+    top = _topK(wsck, topics, catalog, catalog)
+    changed = [_neighborsEntity(wsck, top, catalog)]
+
+    scored = [(jaccard(topics, catalog[c][1]), c)
+              for c in catalog if c != wsck]
+    scored = [(s, c) for s, c in scored if s > 0]
+    lists = ndb.get_multi([ndb.Key(SimilarConferences, c)
+                           for _, c in scored])
+    for (score, other), lst in zip(scored, lists):
+        lst = lst or SimilarConferences(id=other)
+        if wsck in lst.neighborKeys:
+            continue
+        if len(lst.scores) >= SIMILAR_K and score <= lst.scores[-1]:
+            continue
+        entries = sorted(zip(lst.scores, lst.neighborKeys,
+                             lst.neighborNames) + [(score, wsck, conf.name)],
+                         key=lambda e: e[0], reverse=True)[:SIMILAR_K]
+        lst.scores = [e[0] for e in entries]
+        lst.neighborKeys = [e[1] for e in entries]
+        lst.neighborNames = [e[2] for e in entries]
+        changed.append(lst)
+    ndb.put_multi(changed)
+
+
+def removeConference(wsck):
+    """Take a deleted conference out of the neighbor lists naming it. Only
+    conferences sharing a topic can list it, the same candidates
+    addConference considers; their lists stay one short until the next
+    rebuild."""
+    conf = ndb.Key(urlsafe=wsck).get()
+    if not conf or not topicSet(conf):
+        return
+    others = Conference.query(
+        Conference.topics.IN(list(topicSet(conf))[:30])).fetch(
+            INCREMENTAL_CANDIDATES, keys_only=True)
+    lists = ndb.get_multi([ndb.Key(SimilarConferences, k.urlsafe())
+                           for k in others if k.urlsafe() != wsck])
+    changed = []
+    for lst in lists:
+        if lst and wsck in lst.neighborKeys:
+            i = lst.neighborKeys.index(wsck)
+            del lst.neighborKeys[i], lst.neighborNames[i], lst.scores[i]
+            changed.append(lst)
+    ndb.put_multi(changed)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+"""repository.py
+
+Conference Central storage interface for the query and simple write
+paths of ConferenceApi: conference and session listings, the wishlist
+and profile reads and saves. ndb_repository.NdbRepository is what the
+API runs on. sqlite_repository.SqliteRepository is a benchmark store,
+not a second backend: it keeps the same data in SQLite with the
+composite indexes of index.yaml, so the plans of these queries can be
+studied on a machine without the App Engine SDK
+(benchmarks/repository_plans.py).
+
+Entities come back as objects with the model's properties as attributes
+and a key with urlsafe(), which is all the API's form copying needs.
+Tombstoned (deleted) entities are returned like any other; callers skip
+them as before.
+
+Everything transactional or ndb-specific stays in ConferenceApi on ndb
+and is outside this interface: conference creation and deletion (with
+the facet counters), registration and settlement, registration status,
+the home bundle's futures, similar-conference lists, the announcement
+and filterPlayground. Those paths build ndb keys from the request's ids
+and never read or write objects this repository returned, so
+ConferenceApi cannot run on SqliteRepository.
+
+"""
+
+
+class Repository(object):
+    """Storage operations used by ConferenceApi."""
+
+    # - - - Conferences - - - - - - - - - - - - - - - - - - - -
+
+    def getConference(self, wsck):
+        """Return the conference with this websafe key, or None."""
+        raise NotImplementedError
+
+    def getConferences(self, wscks):
+        """Return the conferences with these websafe keys, in order, None
+        for ones that no longer exist."""
+        raise NotImplementedError
+
+    def getOrganizer(self, conf):
+        """Return the Profile of the conference's organizer, or None."""
+        raise NotImplementedError
+
+    def conferencesByOrganizer(self, user_id):
+        """Return the conferences created by a user."""
+        raise NotImplementedError
+
+    def queryConferences(self, filters, inequality_field=None,
+                         weekBuckets=None):
+        """Return conferences matching filters, a list of
+        {'field', 'operator', 'value'} dicts as built by
+        ConferenceApi._formatFilters, ordered by the inequality field (if
+        any) and then name. weekBuckets, if given, restricts the result to
+        conferences in any of those weeks; a conference may then appear
+        once per matching week."""
+        raise NotImplementedError
+
+    def conferencesToAttend(self, prof):
+        """Return the conferences in prof.conferenceKeysToAttend, None for
+        ones that no longer exist."""
+        raise NotImplementedError
+
+    # - - - Sessions - - - - - - - - - - - - - - - - - - - - -
+
+    def getSession(self, wssk):
+        """Return the session with this websafe key, or None."""
+        raise NotImplementedError
+
+    def createSession(self, wsck, data):
+        """Store a new session of a conference from a dict of Session
+        properties and return it."""
+        raise NotImplementedError
+
+    def putSession(self, sess):
+        """Write back a Session returned by this repository."""
+        raise NotImplementedError
+
+    def sessionsByConference(self, wsck, typeOfSession=None):
+        """Return a conference's sessions, of one type (ordered by name) if
+        typeOfSession is given."""
+        raise NotImplementedError
+
+    def sessionsBySpeaker(self, speaker, wsck=None):
+        """Return a speaker's sessions ordered by name or, given wsck, the
+        speaker's sessions in that conference in no particular order."""
+        raise NotImplementedError
+
+    def sessionsByDate(self, date):
+        """Return the sessions on a date, ordered by name."""
+        raise NotImplementedError
+
+    def sessionsByDuration(self, duration):
+        """Return the sessions of a duration in minutes, ordered by name."""
+        raise NotImplementedError
+
+    def sessionsBeforeExcludingType(self, startTime, typeOfSession):
+        """Return the sessions starting before startTime that are not of
+        typeOfSession."""
+        raise NotImplementedError
+
+    def sessionKey(self, wssk):
+        """Return the key of the session with this websafe key, as held in
+        Profile.sessionWishlist, or None if wssk is not a session key."""
+        raise NotImplementedError
+
+    def wishlistSessions(self, prof):
+        """Return the sessions in prof.sessionWishlist, None for ones that
+        no longer exist."""
+        raise NotImplementedError
+
+    # - - - Profiles - - - - - - - - - - - - - - - - - - - - -
+
+    def getProfile(self, user_id):
+        """Return the user's Profile, or None."""
+        raise NotImplementedError
+
+    def createProfile(self, user_id, **fields):
+        """Store and return a new Profile for the user."""
+        raise NotImplementedError
+
+    def putProfile(self, prof):
+        """Write back a Profile returned by this repository."""
+        raise NotImplementedError
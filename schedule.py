@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+
+"""schedule.py
+
+Conference Central session time intervals and overlap detection.
+
+"""
+
+import heapq
+from datetime import datetime
+from datetime import timedelta
+
+
+def sessionInterval(session):
+    """Return (start, end) datetimes for a session, or None if it has no
+    date or start time. A missing duration counts as zero minutes."""
+    if not session.date or not session.startTime:
+        return None
+    start = datetime.combine(session.date, session.startTime)
+    return start, start + timedelta(minutes=session.duration or 0)
+
+
+def findOverlaps(intervals):
+    """Return all pairs (a, b) of overlapping intervals.
+
+    intervals is a list of (start, end, item); pairs hold the items, the
+    earlier-starting one first. Intervals that merely touch do not overlap.
+    Sort by start, then sweep keeping a heap of the intervals still open,
+    O(n log n + k) for k overlapping pairs.
+    """
+    overlaps = []
+    active = []  # heap of (end, seq, item)
+    for seq, (start, end, item) in enumerate(
+            sorted(intervals, key=lambda i: (i[0], i[1]))):
+        while active and active[0][0] <= start:
+            heapq.heappop(active)
+        for _, _, other in active:
+            overlaps.append((other, item))
+        if end > start:
+            heapq.heappush(active, (end, seq, item))
+    return overlaps
+
+
+def conflictsWith(interval, intervals):
+    """Return the items of intervals that overlap a single (start, end)."""
+    start, end = interval
+    return [item for s, e, item in intervals if s < end and start < e]
@@ -13,3 +13,21 @@ created/forked from conference.py by wesc on 2014 may 24
 # Replace the following lines with client IDs obtained from the APIs
 # Console or Cloud Console.
 WEB_CLIENT_ID = 'putClientIDHere'
+
+# Rate limiting (ratelimit.py). Every caller gets RATE_LIMIT_CAPACITY
+# tokens per RATE_LIMIT_WINDOW seconds for each rate limited endpoint,
+# and RATE_LIMIT_USER_CAPACITY tokens across all of them. A call spends
+# the endpoint's cost from RATE_LIMIT_COSTS (default 1).
+RATE_LIMIT_WINDOW = 60
+RATE_LIMIT_CAPACITY = 60
+RATE_LIMIT_USER_CAPACITY = 300
+RATE_LIMIT_COSTS = {
+    'queryConferences': 2,
+    'queryConferencesByDateRange': 4,
+    # two keys-only scans of every session per call
+    'getSessionsByTypeTime': 10,
+    'getSessionsBySpeaker': 2,
+    'getSessionsByDate': 2,
+    'getSessionByDuration': 2,
+    'registerForConference': 1,
+}
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+"""snapshot.py
+
+Conference Central listing snapshot: the default, unfiltered conference
+list that queryConferences returns, prebuilt after conference writes as
+gzip-compressed JSON pages. Each page is one blob entity, named by the
+snapshot version, so serving a page is a single get and the response can
+be cached for as long as a client likes; a small pointer entity names
+the current version.
+
+"""
+
+import gzip
+import time
+from cStringIO import StringIO
+from datetime import datetime
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+from protorpc import protojson
+
+from cache import hotCache
+from models import Conference
+
+MEMCACHE_LISTING_KEY = "LISTING_SNAPSHOT"
+
+# conferences per page; ~100 bytes of gzip each keeps pages well under
+# the 1MB entity limit
+SNAPSHOT_PAGE_SIZE = 100
+# conference writes within one window share one rebuild task
+SNAPSHOT_INTERVAL = 30
+QUERY_BATCH_SIZE = 500
+
+
+class ListingSnapshot(ndb.Model):
+    """ListingSnapshot -- pointer to the current snapshot version"""
+    version   = ndb.IntegerProperty(indexed=False)
+    pages     = ndb.IntegerProperty(indexed=False)
+    count     = ndb.IntegerProperty(indexed=False)
+    generated = ndb.DateTimeProperty(indexed=False)
+
+
+class ListingSnapshotPage(ndb.Model):
+    """ListingSnapshotPage -- one gzip JSON page of a snapshot version,
+    keyed by '<version>:<page>'"""
+    version = ndb.IntegerProperty()
+    data    = ndb.BlobProperty()
+
+
+def pageId(version, page):
+    return '%d:%d' % (version, page)
+
+
+def enqueueRebuild():
+    """Schedule a rebuild; writes within one SNAPSHOT_INTERVAL window share
+    one named task, which runs at the end of the window."""
+    name = 'listing-snapshot-%d' % int(time.time() / SNAPSHOT_INTERVAL)
+    try:
+        taskqueue.add(url='/tasks/rebuild_listing', name=name,
+                      countdown=SNAPSHOT_INTERVAL)
+    except (taskqueue.TaskAlreadyExistsError,
+            taskqueue.TombstonedTaskError):
+        pass
+
+
+def _gzip(data):
+    buf = StringIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as gz:
+        gz.write(data)
+    return buf.getvalue()
+
+
+def rebuild(toForm):
+    """Write a new snapshot version and point at it. toForm(conf) returns
+    the conference's ConferenceForm, as queryConferences builds it.
+
+    Pages are written before the pointer moves, so a client never sees a
+    version with missing pages. The previous version is kept for clients
+    holding a pointer from just before the rebuild; older ones are
+    deleted."""
+    forms = []
+    cursor = None
+    more = True
+    # the order queryConferences uses when there are no filters
+    query = Conference.query().order(Conference.name)
+    while more:
+        confs, cursor, more = query.fetch_page(QUERY_BATCH_SIZE,
+                                               start_cursor=cursor)
+        forms.extend(toForm(conf) for conf in confs if not conf.deleted)
+
+    version = int(time.time() * 1000)
+    pages = max((len(forms) + SNAPSHOT_PAGE_SIZE - 1) // SNAPSHOT_PAGE_SIZE,
+                1)
+    batch = []
+    for page in range(pages):
+        items = forms[page * SNAPSHOT_PAGE_SIZE:
+                      (page + 1) * SNAPSHOT_PAGE_SIZE]
+        # items are encoded exactly as the endpoint encodes them
+        body = '{"version": %d, "page": %d, "pages": %d, "items": [%s]}' % (
+            version, page, pages,
+            ', '.join(protojson.encode_message(f) for f in items))
+        batch.append(ListingSnapshotPage(id=pageId(version, page),
+                                         version=version, data=_gzip(body)))
+    ndb.put_multi(batch)
+
+    @ndb.transactional
+    def _point():
+        current = ListingSnapshot.get_by_id('current')
+        if current and current.version >= version:
+            return None
+        ListingSnapshot(id='current', version=version, pages=pages,
+                        count=len(forms), generated=datetime.utcnow()).put()
+        return current.version if current else version
+
+    previous = _point()
+    if previous is None:
+        # a later rebuild moved the pointer first; this one is unused
+        ndb.delete_multi([page.key for page in batch])
+        return
+    # drop the cached pointer so the next read loads the new one;
+    # hotCache.delete would remember it locally as absent
+    memcache.delete(MEMCACHE_LISTING_KEY)
+    hotCache.invalidate(MEMCACHE_LISTING_KEY)
+    ndb.delete_multi(ListingSnapshotPage.query(
+        ListingSnapshotPage.version < previous).fetch(keys_only=True))
+
+
+def _loadPointer():
+    current = ListingSnapshot.get_by_id('current')
+    if not current:
+        return None
+    return {'version': current.version,
+            'pages': current.pages,
+            'count': current.count,
+            'generated': current.generated.isoformat()}
+
+
+def getPointer():
+    """Return the current snapshot pointer as a dict, or None if no
+    snapshot has been built yet."""
+    return hotCache.get(MEMCACHE_LISTING_KEY, _loadPointer)
+
+
+def getPage(version, page):
+    """Return the gzip JSON of one snapshot page, or None."""
+    page = ListingSnapshotPage.get_by_id(pageId(version, page))
+    return page.data if page else None
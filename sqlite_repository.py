@@ -0,0 +1,425 @@
+#!/usr/bin/env python
+
+"""sqlite_repository.py
+
+Conference Central repository on SQLite, for studying query plans and
+access patterns without the App Engine SDK (the dev_appserver stubs have
+no real indexes). A benchmark store only, see repository.py: it covers
+the Repository interface, not the ndb paths of ConferenceApi. Needs only
+the standard library and PyYAML.
+
+Every composite index in index.yaml becomes a SQLite index, and every
+indexed property gets a single-column index like the datastore's
+built-in ones. The datastore writes one index row per value of a
+repeated property (per combination of values, if an index has several).
+Indexes on repeated properties are therefore built over a table that
+holds one row per combination, kept in step with the entity table.
+
+"""
+
+import itertools
+import os
+import sqlite3
+from datetime import date
+from datetime import datetime
+from datetime import time
+
+import yaml
+
+from repository import Repository
+
+INDEX_YAML = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'index.yaml')
+
+# kind -> (scalar properties, repeated properties); mirrors models.py
+SCHEMA = {
+    'Conference': (
+        ('name', 'description', 'organizerUserId', 'city', 'startDate',
+         'month', 'endDate', 'maxAttendees', 'seatsAvailable',
+         'admissionQueue', 'deleted'),
+        ('topics', 'weekBuckets')),
+    'Session': (
+        ('name', 'highlights', 'speaker', 'duration', 'typeOfSession',
+         'date', 'startTime', 'websafeConferenceKey', 'deleted'),
+        ()),
+    'Profile': (
+        ('displayName', 'mainEmail', 'teeShirtSize'),
+        ('conferenceKeysToAttend', 'sessionWishlist')),
+}
+# Profile's repeated properties are key lists, read back in order and
+# not queried through composite indexes
+KEY_LISTS = {'conferenceKeysToAttend': 'Conference',
+             'sessionWishlist': 'Session'}
+
+
+class SqliteKey(object):
+    """Stand-in for ndb.Key: a kind and a string id, which is also the
+    websafe form."""
+
+    def __init__(self, kind, id_):
+        self._kind = kind
+        self._id = id_
+
+    def kind(self):
+        return self._kind
+
+    def id(self):
+        return self._id
+
+    def urlsafe(self):
+        return self._id
+
+    def __eq__(self, other):
+        return isinstance(other, SqliteKey) and \
+            (self._kind, self._id) == (other._kind, other._id)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self._kind, self._id))
+
+    def __repr__(self):
+        return 'SqliteKey(%r, %r)' % (self._kind, self._id)
+
+
+class Record(object):
+    """An entity read from SQLite: a key plus the model's properties as
+    attributes."""
+
+    def __init__(self, key, **values):
+        self.key = key
+        for name, value in values.items():
+            setattr(self, name, value)
+
+
+def _toColumn(value):
+    if isinstance(value, (date, datetime, time)):
+        return value.isoformat()
+    if isinstance(value, bool):
+        return int(value)
+    return value
+
+
+def _fromColumn(name, value):
+    if value is None:
+        return None
+    if name in ('startDate', 'endDate', 'date'):
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    if name == 'startTime':
+        return datetime.strptime(value[:8], '%H:%M:%S').time()
+    if name in ('admissionQueue', 'deleted'):
+        return bool(value)
+    return value
+
+
+def _quote(name):
+    return '"%s"' % name
+
+
+def loadIndexes(path=INDEX_YAML):
+    """Return [(kind, ancestor, [property names])] from index.yaml."""
+    with open(path) as f:
+        spec = yaml.safe_load(f) or {}
+    return [(index['kind'], bool(index.get('ancestor')),
+             [p['name'] for p in index.get('properties', [])])
+            for index in spec.get('indexes') or []]
+
+
+class SqliteRepository(Repository):
+    """Repository backed by a SQLite database (':memory:' by default)."""
+
+    def __init__(self, path=':memory:', index_yaml=INDEX_YAML):
+        self.db = sqlite3.connect(path)
+        self._ids = itertools.count(1)
+        # when a list, every statement's EXPLAIN QUERY PLAN rows are
+        # appended to it; see explain()
+        self._plans = None
+        # repeated property sets with an index-row table, per kind
+        self._exploded = {}
+        self.indexes = loadIndexes(index_yaml)
+        self._createSchema()
+
+    # - - - Schema - - - - - - - - - - - - - - - - - - - - - -
+
+    def _explodedTable(self, kind, repeated):
+        return '%s__%s' % (kind, '__'.join(repeated))
+
+    def _createSchema(self):
+        ddl = []
+        for kind, (scalars, repeated) in sorted(SCHEMA.items()):
+            cols = ['id TEXT PRIMARY KEY', 'parent TEXT'] + \
+                [_quote(p) for p in scalars]
+            ddl.append('CREATE TABLE %s (%s)' % (kind, ', '.join(cols)))
+            # built-in single-property indexes
+            for prop in scalars:
+                ddl.append('CREATE INDEX %s_%s ON %s (%s, id)' % (
+                    kind, prop, kind, _quote(prop)))
+            for prop in repeated:
+                table = '%s_%s' % (kind, prop)
+                ddl.append('CREATE TABLE %s (id TEXT, position INTEGER, '
+                           '%s)' % (table, _quote(prop)))
+                ddl.append('CREATE INDEX %s_value ON %s (%s, id)' % (
+                    table, table, _quote(prop)))
+                ddl.append('CREATE INDEX %s_id ON %s (id, position)' % (
+                    table, table))
+
+        for n, (kind, ancestor, props) in enumerate(self.indexes):
+            if kind not in SCHEMA:
+                # kinds not behind the repository (e.g. RegistrationClaim)
+                continue
+            scalars, repeated = SCHEMA[kind]
+            used = tuple(p for p in repeated if p in props)
+            table = kind
+            if used:
+                table = self._explodedTable(kind, used)
+                if used not in self._exploded.setdefault(kind, set()):
+                    self._exploded[kind].add(used)
+                    cols = ['id TEXT', 'parent TEXT'] + \
+                        [_quote(p) for p in scalars + used]
+                    ddl.append('CREATE TABLE %s (%s)' % (table,
+                                                         ', '.join(cols)))
+            cols = (['parent'] if ancestor else []) + props + ['id']
+            ddl.append('CREATE INDEX %s_idx%d ON %s (%s)' % (
+                kind, n, table, ', '.join(_quote(c) for c in cols)))
+        for statement in ddl:
+            self.db.execute(statement)
+
+    # - - - Storage - - - - - - - - - - - - - - - - - - - - - -
+
+    def explain(self, fn, *args, **kwargs):
+        """Call fn and return (result, [query plan rows of each statement
+        it ran])."""
+        self._plans = []
+        try:
+            return fn(*args, **kwargs), self._plans
+        finally:
+            self._plans = None
+
+    def _execute(self, sql, params=()):
+        if self._plans is not None and sql.lstrip().startswith('SELECT'):
+            self._plans.append(
+                (sql, self.db.execute('EXPLAIN QUERY PLAN ' + sql,
+                                      params).fetchall()))
+        return self.db.execute(sql, params)
+
+    def _newId(self, kind):
+        return '%s-%d' % (kind, next(self._ids))
+
+    def _write(self, kind, record, parent=None):
+        """Insert or replace an entity with its repeated values and index
+        rows."""
+        scalars, repeated = SCHEMA[kind]
+        rid = record.key.id()
+        row = [rid, parent] + [_toColumn(getattr(record, p, None))
+                               for p in scalars]
+        self._execute('INSERT OR REPLACE INTO %s VALUES (%s)' % (
+            kind, ', '.join('?' * len(row))), row)
+
+        values = {}
+        for prop in repeated:
+            table = '%s_%s' % (kind, prop)
+            self._execute('DELETE FROM %s WHERE id = ?' % table, (rid,))
+            values[prop] = [v.id() if prop in KEY_LISTS else _toColumn(v)
+                            for v in getattr(record, prop, None) or []]
+            self.db.executemany(
+                'INSERT INTO %s VALUES (?, ?, ?)' % table,
+                [(rid, i, v) for i, v in enumerate(values[prop])])
+
+        for used in self._exploded.get(kind, ()):
+            table = self._explodedTable(kind, used)
+            self._execute('DELETE FROM %s WHERE id = ?' % table, (rid,))
+            combos = itertools.product(*[values[p] for p in used])
+            self.db.executemany(
+                'INSERT INTO %s VALUES (%s)' % (
+                    table, ', '.join('?' * (len(row) + len(used)))),
+                [row + list(combo) for combo in combos])
+
+    def _load(self, kind, ids):
+        """Return records for ids, in order; None for missing ones."""
+        if not ids:
+            return []
+        scalars, repeated = SCHEMA[kind]
+        marks = ', '.join('?' * len(ids))
+        rows = self._execute('SELECT * FROM %s WHERE id IN (%s)' % (
+            kind, marks), list(ids)).fetchall()
+        found = {}
+        for row in rows:
+            found[row[0]] = dict((p, _fromColumn(p, v))
+                                 for p, v in zip(scalars, row[2:]))
+            for prop in repeated:
+                found[row[0]][prop] = []
+        for prop in repeated:
+            for rid, value in self._execute(
+                    'SELECT id, %s FROM %s_%s WHERE id IN (%s) '
+                    'ORDER BY id, position' % (_quote(prop), kind, prop,
+                                               marks), list(ids)):
+                if prop in KEY_LISTS:
+                    value = SqliteKey(KEY_LISTS[prop], value)
+                found[rid][prop].append(value)
+        return [Record(SqliteKey(kind, rid), **found[rid])
+                if rid in found else None for rid in ids]
+
+    def _select(self, kind, sql, params=()):
+        """Run a query returning ids; load them as records in order."""
+        ids = [row[0] for row in self._execute(sql, params)]
+        return self._load(kind, ids)
+
+    def addConference(self, **fields):
+        """Store a new conference and return it. Not part of Repository:
+        ConferenceApi creates conferences on ndb, with the facet counters,
+        so this only loads benchmark data."""
+        fields.setdefault('admissionQueue', False)
+        fields.setdefault('deleted', False)
+        conf = Record(SqliteKey('Conference', self._newId('Conference')),
+                      **fields)
+        self._write('Conference', conf)
+        return conf
+
+    def commit(self):
+        self.db.commit()
+
+    # - - - Conferences - - - - - - - - - - - - - - - - - - - -
+
+    def getConference(self, wsck):
+        return self._load('Conference', [wsck])[0]
+
+    def getConferences(self, wscks):
+        return self._load('Conference', list(wscks))
+
+    def getOrganizer(self, conf):
+        return self.getProfile(conf.organizerUserId)
+
+    def conferencesByOrganizer(self, user_id):
+        return self._select(
+            'Conference',
+            'SELECT id FROM Conference WHERE organizerUserId = ?', (user_id,))
+
+    def queryConferences(self, filters, inequality_field=None,
+                         weekBuckets=None):
+        repeated = SCHEMA['Conference'][1]
+        by_field = {}
+        for filtr in filters:
+            by_field.setdefault(filtr['field'], []).append(filtr)
+        used = tuple(p for p in repeated
+                     if p in by_field or (p == 'weekBuckets' and
+                                          weekBuckets))
+        if used in self._exploded.get('Conference', ()):
+            table = self._explodedTable('Conference', used)
+        else:
+            # no index covers this combination; each repeated value is
+            # matched through its value table instead
+            table, used = 'Conference', ()
+
+        where = []
+        params = []
+        for field, field_filters in sorted(by_field.items()):
+            for n, filtr in enumerate(field_filters):
+                if field in repeated and (field not in used or n > 0):
+                    # e.g. a second topic: the entity must hold both
+                    where.append('c.id IN (SELECT id FROM Conference_%s '
+                                 'WHERE %s %s ?)' % (field, _quote(field),
+                                                     filtr['operator']))
+                else:
+                    where.append('c.%s %s ?' % (_quote(field),
+                                                filtr['operator']))
+                params.append(_toColumn(filtr['value']))
+        if weekBuckets:
+            marks = ', '.join('?' * len(weekBuckets))
+            if 'weekBuckets' in used:
+                where.append('c."weekBuckets" IN (%s)' % marks)
+            else:
+                where.append('c.id IN (SELECT id FROM Conference_weekBuckets'
+                             ' WHERE "weekBuckets" IN (%s))' % marks)
+            params.extend(weekBuckets)
+
+        order = ([_quote(inequality_field)] if inequality_field else []) + \
+            ['"name"']
+        sql = 'SELECT c.id FROM %s AS c' % table
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY ' + ', '.join('c.' + o for o in order)
+        return self._select('Conference', sql, params)
+
+    def conferencesToAttend(self, prof):
+        return self._load('Conference',
+                          [k.id() for k in prof.conferenceKeysToAttend])
+
+    # - - - Sessions - - - - - - - - - - - - - - - - - - - - -
+
+    def getSession(self, wssk):
+        return self._load('Session', [wssk])[0]
+
+    def createSession(self, wsck, data):
+        sess = Record(SqliteKey('Session', self._newId('Session')),
+                      **dict(data, deleted=data.get('deleted', False)))
+        # like the ndb sessions, the parent is the websafe conference key
+        self._write('Session', sess, parent=wsck)
+        return sess
+
+    def putSession(self, sess):
+        self._write('Session', sess, parent=sess.websafeConferenceKey)
+
+    def sessionsByConference(self, wsck, typeOfSession=None):
+        if typeOfSession is None:
+            return self._select(
+                'Session', 'SELECT id FROM Session WHERE parent = ?',
+                (wsck,))
+        return self._select(
+            'Session',
+            'SELECT id FROM Session WHERE parent = ? AND '
+            '"typeOfSession" = ? ORDER BY "name"', (wsck, typeOfSession))
+
+    def sessionsBySpeaker(self, speaker, wsck=None):
+        if wsck is not None:
+            return self._select(
+                'Session',
+                'SELECT id FROM Session WHERE "speaker" = ? AND '
+                '"websafeConferenceKey" = ?', (speaker, wsck))
+        return self._select(
+            'Session',
+            'SELECT id FROM Session WHERE "speaker" = ? ORDER BY "name"',
+            (speaker,))
+
+    def sessionsByDate(self, date):
+        return self._select(
+            'Session',
+            'SELECT id FROM Session WHERE "date" = ? ORDER BY "name"',
+            (_toColumn(date),))
+
+    def sessionsByDuration(self, duration):
+        return self._select(
+            'Session',
+            'SELECT id FROM Session WHERE "duration" = ? ORDER BY "name"',
+            (duration,))
+
+    def sessionsBeforeExcludingType(self, startTime, typeOfSession):
+        # the same two single-property scans the datastore has to make
+        return self._select(
+            'Session',
+            'SELECT id FROM Session WHERE "typeOfSession" != ? '
+            'INTERSECT SELECT id FROM Session WHERE "startTime" < ?',
+            (typeOfSession, _toColumn(startTime)))
+
+    def sessionKey(self, wssk):
+        if not wssk or not wssk.startswith('Session-'):
+            return None
+        return SqliteKey('Session', wssk)
+
+    def wishlistSessions(self, prof):
+        return self._load('Session', [k.id() for k in prof.sessionWishlist])
+
+    # - - - Profiles - - - - - - - - - - - - - - - - - - - - -
+
+    def getProfile(self, user_id):
+        return self._load('Profile', [user_id])[0]
+
+    def createProfile(self, user_id, **fields):
+        for prop in KEY_LISTS:
+            fields.setdefault(prop, [])
+        prof = Record(SqliteKey('Profile', user_id), **fields)
+        self._write('Profile', prof)
+        return prof
+
+    def putProfile(self, prof):
+        self._write('Profile', prof)
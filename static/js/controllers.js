@@ -249,7 +249,7 @@ conferenceApp.controllers.controller('CreateConferenceCtrl',
  * @description
  * A controller used for the Show conferences page.
  */
-conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $log, oauth2Provider, HTTP_ERRORS) {
+conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $rootScope, $log, $http, $q, oauth2Provider, HTTP_ERRORS) {
 
     /**
      * Holds the status if the query is being executed.
@@ -427,6 +427,32 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
      * Invokes the conference.queryConferences API.
      */
     $scope.queryConferencesAll = function () {
+        // The unfiltered list is also served as a cacheable static snapshot.
+        if ($scope.filters.length == 0 && !$scope.listingSnapshotFailed) {
+            $scope.loading = true;
+            $http.get('/listing').then(function (pointer) {
+                var pages = [];
+                for (var i = 0; i < pointer.data.pages; i++) {
+                    pages.push($http.get(pointer.data.pageUrl.replace('{page}', i)));
+                }
+                return $q.all(pages);
+            }).then(function (pages) {
+                $scope.loading = false;
+                $scope.conferences = [];
+                angular.forEach(pages, function (page) {
+                    angular.forEach(page.data.items, function (conference) {
+                        $scope.conferences.push(conference);
+                    });
+                });
+                $scope.submitted = true;
+            }, function () {
+                // No snapshot yet; query the API instead.
+                $scope.loading = false;
+                $scope.listingSnapshotFailed = true;
+                $scope.queryConferencesAll();
+            });
+            return;
+        }
         var sendFilters = {
             filters: []
         }
@@ -510,6 +536,12 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
      * invokes the conference.getConference method n times where n == the number of the conferences to attend.
      */
     $scope.getConferencesAttend = function () {
+        var bundle = $rootScope.takeHomeBundle('conferencesToAttend');
+        if (bundle && bundle.profile) {
+            $scope.conferences = bundle.conferencesToAttend || [];
+            $scope.submitted = true;
+            return;
+        }
         $scope.loading = true;
         gapi.client.conference.getConferencesToAttend().
             execute(function (resp) {
@@ -547,11 +579,44 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
  * @description
  * A controller used for the conference detail page.
  */
-conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $log, $routeParams, HTTP_ERRORS) {
+conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $log, $routeParams, $timeout, HTTP_ERRORS) {
     $scope.conference = {};
 
     $scope.isUserAttending = false;
 
+    /**
+     * Interval in milliseconds between registration status polls for admission-queued conferences.
+     * @type {number}
+     */
+    $scope.registrationPollInterval = 2000;
+
+    /**
+     * Polls the conference.getRegistrationStatus method until the queued registration is settled.
+     */
+    $scope.pollRegistrationStatus = function () {
+        gapi.client.conference.getRegistrationStatus({
+            websafeConferenceKey: $routeParams.websafeConferenceKey
+        }).execute(function (resp) {
+            $scope.$apply(function () {
+                if (resp.error) {
+                    $log.error('Failed to get the registration status : ' + (resp.error.message || ''));
+                    return;
+                }
+                var status = resp.result.status;
+                if (status == 'REGISTERED') {
+                    $scope.messages = 'Registered for the conference';
+                    $scope.alertStatus = 'success';
+                    $scope.isUserAttending = true;
+                } else if (status == 'WAITLISTED') {
+                    $scope.messages = 'The conference is full, you are on the waitlist';
+                    $scope.alertStatus = 'info';
+                } else if (status == 'PENDING' || status == 'GRANTED') {
+                    $timeout($scope.pollRegistrationStatus, $scope.registrationPollInterval);
+                }
+            });
+        });
+    };
+
     /**
      * Initializes the conference detail page.
      * Invokes the conference.getConference method and sets the returned conference in the $scope.
@@ -579,6 +644,19 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
             });
         });
 
+        $scope.similarConferences = [];
+        gapi.client.conference.getSimilarConferences({
+            websafeConferenceKey: $routeParams.websafeConferenceKey
+        }).execute(function (resp) {
+            $scope.$apply(function () {
+                if (resp.error) {
+                    $log.error('Failed to get similar conferences : ' + (resp.error.message || ''));
+                } else {
+                    $scope.similarConferences = resp.result.items || [];
+                }
+            });
+        });
+
         $scope.loading = true;
         // If the user is attending the conference, updates the status message and available function.
         gapi.client.conference.getProfile().execute(function (resp) {
@@ -624,7 +702,12 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
                         return;
                     }
                 } else {
-                    if (resp.result) {
+                    if (resp.result && $scope.conference.admissionQueue) {
+                        // Request queued, wait for the settlement.
+                        $scope.messages = 'Registration requested, waiting for a seat';
+                        $scope.alertStatus = 'info';
+                        $timeout($scope.pollRegistrationStatus, $scope.registrationPollInterval);
+                    } else if (resp.result) {
                         // Register succeeded.
                         $scope.messages = 'Registered for the conference';
                         $scope.alertStatus = 'success';
@@ -691,7 +774,46 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
  * such as user authentications.
  *
  */
-conferenceApp.controllers.controller('RootCtrl', function ($scope, $location, oauth2Provider) {
+conferenceApp.controllers.controller('RootCtrl', function ($scope, $rootScope, $location, $log, oauth2Provider) {
+
+    /**
+     * How long after loading the home bundle may stand in for a fresh request. The bundle is loaded at sign-in,
+     * so it only serves the page shown right then.
+     */
+    var HOME_BUNDLE_MAX_AGE_MS = 10000;
+
+    /**
+     * Returns the home bundle for the first render of the given part, or null if that part has been used
+     * already or the bundle is older than HOME_BUNDLE_MAX_AGE_MS; the caller then fetches fresh data.
+     */
+    $rootScope.takeHomeBundle = function (part) {
+        var bundle = $rootScope.homeBundle;
+        if (!bundle || bundle.used[part] || new Date().getTime() - bundle.loaded > HOME_BUNDLE_MAX_AGE_MS) {
+            return null;
+        }
+        bundle.used[part] = true;
+        return bundle;
+    };
+
+    /**
+     * Invokes the conference.getHomeBundle method, which returns the profile, the conferences to attend and the
+     * announcement in one round trip, and shares the result through $rootScope.homeBundle. The conference
+     * list itself comes from the listing snapshot.
+     */
+    $scope.loadHomeBundle = function () {
+        gapi.client.conference.getHomeBundle().execute(function (resp) {
+            $scope.$apply(function () {
+                if (resp.error) {
+                    $log.error('Failed to get the home bundle : ' + (resp.error.message || ''));
+                    return;
+                }
+                $rootScope.homeBundle = resp.result;
+                $rootScope.homeBundle.loaded = new Date().getTime();
+                $rootScope.homeBundle.used = {};
+                $rootScope.announcement = resp.result.announcement;
+            });
+        });
+    };
 
     /**
      * Returns if the viewLocation is the currently viewed page.
@@ -723,6 +845,7 @@ conferenceApp.controllers.controller('RootCtrl', function ($scope, $location, oa
                         oauth2Provider.signedIn = true;
                         $scope.alertStatus = 'success';
                         $scope.rootMessages = 'Logged in with ' + resp.email;
+                        $scope.loadHomeBundle();
                     }
                 });
             });
@@ -743,6 +866,7 @@ conferenceApp.controllers.controller('RootCtrl', function ($scope, $location, oa
                         oauth2Provider.signedIn = true;
                     });
                 }
+                $scope.loadHomeBundle();
             },
             'clientid': oauth2Provider.CLIENT_ID,
             'cookiepolicy': 'single_host_origin',
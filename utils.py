@@ -2,8 +2,8 @@ import json
 import os
 import time
 import uuid
+from datetime import timedelta
 
-from google.appengine.api import urlfetch
 from models import Profile
 
 def getUserId(user, id_type="email"):
@@ -12,6 +12,8 @@ def getUserId(user, id_type="email"):
 
     if id_type == "oauth":
         """A workaround implementation for getting userid."""
+        # imported here; only this rarely used path needs urlfetch
+        from google.appengine.api import urlfetch
         auth = os.getenv('HTTP_AUTHORIZATION')
         bearer, token = auth.split()
         token_type = 'id_token'
@@ -43,3 +45,17 @@ def getUserId(user, id_type="email"):
             return profile.id()
         else:
             return str(uuid.uuid1().get_hex())
+
+
+def weekBuckets(start, end=None):
+    """Return the ISO weeks, as year * 100 + week, covering start..end."""
+    if not start:
+        return []
+    end = max(end or start, start)
+    day = start - timedelta(days=start.weekday())
+    buckets = []
+    while day <= end:
+        year, week, _ = day.isocalendar()
+        buckets.append(year * 100 + week)
+        day += timedelta(weeks=1)
+    return buckets